@@ -0,0 +1,318 @@
+"""
+Benchmark the upload, download, listing, sensor data and conversion endpoints.
+
+The app is driven either in-process through the FastAPI test client or over
+HTTP against a uvicorn server started for the run. Results (throughput,
+p50/p99 latency, peak memory) are written as JSON so runs can be compared
+across commits:
+
+    python benchmarks/bench_api.py --mode inprocess --output before.json
+    python benchmarks/bench_api.py --mode uvicorn --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+DEFAULT_IFC = os.path.join(REPO_DIR, "haus.ifc")
+DEFAULT_IMAGE = os.path.join(REPO_DIR, "local store", "haus.jpg")
+SCENARIOS = ["upload", "download", "list", "sensordata", "convert"]
+
+
+def synthetic_ifc(path, size_bytes):
+    """
+    Write a syntactically valid IFC file of roughly the requested size
+    """
+    with open(path, "w") as f:
+        f.write("ISO-10303-21;\nHEADER;\nFILE_DESCRIPTION(('ViewDefinition [CoordinationView]'),'2;1');\n"
+                "FILE_NAME('synthetic.ifc','2024-01-01T00:00:00',(''),(''),'bench','bench','');\n"
+                "FILE_SCHEMA(('IFC4'));\nENDSEC;\nDATA;\n")
+        entity = 1
+        while f.tell() < size_bytes:
+            f.write(f"#{entity}=IFCCARTESIANPOINT(({entity}.,{entity * 2}.,{entity * 3}.));\n")
+            entity += 1
+        f.write("ENDSEC;\nEND-ISO-10303-21;\n")
+    return path
+
+
+def scratch_environment(workdir):
+    """
+    Point the app's directories, database and lock files at the benchmark's scratch directory
+    """
+    return {
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "CONVERTED_DIR": os.path.join(workdir, "converted"),
+        "LOCK_DIR": os.path.join(workdir, "locks"),
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, errors, elapsed, peak_memory):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+class Workload:
+    def __init__(self, client, ifc_path, image_path, folder_count):
+        """
+        Requests issued by each scenario, shared by the in-process and uvicorn runners
+        """
+        self.client = client
+        self.ifc_path = ifc_path
+        self.image_path = image_path
+        self.folder_count = folder_count
+        self.ifc_name = os.path.basename(ifc_path)
+        self.folder = os.path.splitext(self.ifc_name)[0]
+
+    def upload(self, name=None):
+        with open(self.ifc_path, "rb") as ifc, open(self.image_path, "rb") as image:
+            files = {
+                "ifc_file": (name or self.ifc_name, ifc),
+                "img_file": (os.path.basename(self.image_path), image),
+            }
+            return self.client.post("/upload/", files=files)
+
+    def prepare(self):
+        # Give /list something to walk and /download something to archive
+        for index in range(self.folder_count):
+            self.upload(f"bench_{index}.ifc")
+        self.upload()
+
+    def download(self):
+        return self.client.get(f"/download/{self.folder}")
+
+    def list(self):
+        return self.client.get("/list")
+
+    def sensordata(self):
+        return self.client.get("/sensordata")
+
+    def convert(self, poll_interval=0.5):
+        response = self.client.post("/convert/", data={"filename": f"{self.folder}/{self.ifc_name}"})
+        if response.status_code >= 400:
+            return response
+        job_url = f"/jobs/{response.json()['job_id']}"
+        while True:
+            response = self.client.get(job_url)
+            if response.json()["status"] not in ("queued", "running"):
+                return response
+            time.sleep(poll_interval)
+
+
+def run_scenario(workload, scenario, iterations, concurrency):
+    """
+    Call a scenario repeatedly and collect per-request latencies
+    """
+    call = getattr(workload, scenario)
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one():
+        nonlocal errors
+        start = time.perf_counter()
+        response = call()
+        duration = time.perf_counter() - start
+        failed = response.status_code >= 400 or (
+            scenario == "convert" and response.json().get("status") != "success")
+        with lock:
+            latencies.append(duration)
+            errors += failed
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(one) for _ in range(iterations)]:
+                future.result()
+    else:
+        for _ in range(iterations):
+            one()
+    return latencies, errors, time.perf_counter() - start
+
+
+def run_inprocess(args, scenarios, workdir):
+    from fastapi.testclient import TestClient
+    import main
+
+    results = {}
+    with TestClient(main.app) as client:
+        workload = Workload(client, args.ifc, args.image, args.folders)
+        workload.prepare()
+        for scenario in scenarios:
+            tracemalloc.start()
+            latencies, errors, elapsed = run_scenario(workload, scenario, args.iterations, 1)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[scenario] = summarize(latencies, errors, elapsed, peak)
+    return results
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _server_peak_memory(client):
+    # Read the server's own peak RSS from the /metrics endpoint
+    for line in client.get("/metrics").text.splitlines():
+        if line.startswith('process_memory_bytes{kind="peak_resident"}'):
+            return int(float(line.split()[-1]))
+    return None
+
+
+def run_uvicorn(args, scenarios, workdir):
+    import httpx
+
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(args.workers),
+         "--log-level", "warning"],
+        cwd=workdir,
+        env={**os.environ, **scratch_environment(workdir),
+             "PYTHONPATH": os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")]))},
+    )
+    results = {}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    client.get("/sensordata")
+                    break
+                except httpx.TransportError:
+                    if time.monotonic() > deadline or server.poll() is not None:
+                        raise RuntimeError("uvicorn did not start")
+                    time.sleep(0.2)
+            workload = Workload(client, args.ifc, args.image, args.folders)
+            workload.prepare()
+            for scenario in scenarios:
+                latencies, errors, elapsed = run_scenario(workload, scenario, args.iterations, args.concurrency)
+                results[scenario] = summarize(latencies, errors, elapsed, _server_peak_memory(client))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    print(f"{'scenario':<12} {'metric':<16} {'baseline':>12} {'current':>12} {'change':>9}")
+    for scenario, current in results.items():
+        previous = baseline.get(scenario)
+        if not previous:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p99_ms", "peak_memory_bytes"):
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            print(f"{scenario:<12} {metric:<16} {old:>12} {new:>12} {(new - old) / old * 100:>+8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the IFC File Storage API")
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS[:-1],
+                        help="Conversion is opt-in because it needs docker")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=1, help="Parallel clients (uvicorn mode)")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--folders", type=int, default=20, help="Extra folders uploaded before the run")
+    parser.add_argument("--ifc", default=DEFAULT_IFC, help="IFC file to upload")
+    parser.add_argument("--synthetic-size", type=int,
+                        help="Upload a synthetic IFC file of this many bytes instead of --ifc")
+    parser.add_argument("--generated-elements", type=int,
+                        help="Upload a model with this many elements from generate_ifc.py instead of --ifc")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for --generated-elements")
+    parser.add_argument("--image", default=DEFAULT_IMAGE)
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--compare", help="Previous JSON results to compare against")
+    args = parser.parse_args()
+
+    # Paths given on the command line stay relative to where the benchmark was started
+    args.ifc, args.image = os.path.abspath(args.ifc), os.path.abspath(args.image)
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="bim-bench-")
+    try:
+        # The app runs from the scratch directory and logs to unused/ below it
+        os.makedirs(os.path.join(workdir, "unused"))
+        if args.synthetic_size:
+            args.ifc = synthetic_ifc(os.path.join(workdir, "synthetic.ifc"), args.synthetic_size)
+        elif args.generated_elements:
+            from generate_ifc import generate
+
+            args.ifc = os.path.join(workdir, "generated.ifc")
+            storeys = max(1, args.generated_elements // 1000)
+            generate(args.ifc, storeys=storeys, elements_per_storey=args.generated_elements // storeys,
+                     seed=args.seed)
+        ifc_size = os.path.getsize(args.ifc)
+        if args.mode == "inprocess":
+            # main reads its directories from the environment at import time
+            os.environ.update(scratch_environment(workdir))
+            os.chdir(workdir)
+            results = run_inprocess(args, args.scenarios, workdir)
+        else:
+            results = run_uvicorn(args, args.scenarios, workdir)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mode": args.mode,
+        "ifc_file": os.path.basename(args.ifc),
+        "ifc_size_bytes": ifc_size,
+        "iterations": args.iterations,
+        "concurrency": args.concurrency if args.mode == "uvicorn" else 1,
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Benchmark the vectorised OBJ writer against the line by line loop it replaced.
+
+Meshes are triangulated once from an IFC file (haus.ifc by default) or
+generated randomly, then written with the legacy loop from
+unused/converter.py, fed the tuples it used to read, and with ObjWriter,
+fed NumPy arrays, in exact, fixed precision and gzip mode. Exact output must match the legacy file byte for byte and fixed
+precision output must match it within the rounding of the chosen decimals.
+The exit status is non-zero if the fixed precision writer misses the target speedup:
+
+    python benchmarks/bench_obj_writer.py --repeat 20 --output obj.json
+    python benchmarks/bench_obj_writer.py --synthetic-vertices 2000000 --target 5
+"""
+import argparse
+import gzip
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from obj_writer import DEFAULT_PRECISION, ObjWriter  # noqa: E402
+
+DEFAULT_IFC = os.path.join(REPO_DIR, "haus.ifc")
+
+
+def ifc_meshes(path):
+    """
+    Triangulate every element of an IFC file into (verts, normals, faces) arrays
+    read from IfcOpenShell's buffers, as the converter passes them to ObjWriter
+    """
+    import ifcopenshell
+    import ifcopenshell.geom
+    import ifcopenshell.util.shape
+
+    settings = ifcopenshell.geom.settings()
+    settings.set("use-world-coords", True)
+    # The iterator does not keep the file alive, hold a reference until it is done
+    ifc_file = ifcopenshell.open(path)
+    iterator = ifcopenshell.geom.iterator(settings, ifc_file)
+    meshes = []
+    if iterator.initialize():
+        while True:
+            geometry = iterator.get().geometry
+            meshes.append((ifcopenshell.util.shape.get_vertices(geometry),
+                           ifcopenshell.util.shape.get_normals(geometry),
+                           ifcopenshell.util.shape.get_faces(geometry)))
+            if not iterator.next():
+                break
+    return meshes
+
+
+def synthetic_meshes(vertex_count, seed, vertices_per_mesh=500):
+    rng = np.random.default_rng(seed)
+    meshes = []
+    for start in range(0, vertex_count, vertices_per_mesh):
+        count = min(vertices_per_mesh, vertex_count - start)
+        normals = rng.normal(size=(count, 3))
+        normals /= np.linalg.norm(normals, axis=1)[:, None]
+        meshes.append((rng.uniform(-100, 100, (count, 3)), normals, rng.integers(0, count, (count * 2, 3))))
+    return meshes
+
+
+def as_tuples(meshes):
+    """
+    The flat tuples of Python numbers the legacy loop read from shape.verts, shape.normals and shape.faces
+    """
+    return [tuple(tuple(array.ravel().tolist()) for array in mesh) for mesh in meshes]
+
+
+def write_legacy(path, meshes):
+    """
+    The loop of IFCConverter._convert_to_obj before ObjWriter, one write per line
+    """
+    with open(path, "w") as obj_file:
+        vertex_offset = 1
+        normal_offset = 1
+        for verts, normals, faces in meshes:
+            for i in range(0, len(verts), 3):
+                obj_file.write(f"v {verts[i]} {verts[i + 1]} {verts[i + 2]}\n")
+            if normals:
+                for i in range(0, len(normals), 3):
+                    obj_file.write(f"vn {normals[i]} {normals[i + 1]} {normals[i + 2]}\n")
+            for i in range(0, len(faces), 3):
+                if normals:
+                    v1, v2, v3 = faces[i:i + 3]
+                    obj_file.write(f"f {v1 + vertex_offset}/{v1 + normal_offset} "
+                                   f"{v2 + vertex_offset}/{v2 + normal_offset} "
+                                   f"{v3 + vertex_offset}/{v3 + normal_offset}\n")
+                else:
+                    v1, v2, v3 = faces[i:i + 3]
+                    obj_file.write(f"f {v1 + vertex_offset} {v2 + vertex_offset} {v3 + vertex_offset}\n")
+            vertex_offset += len(verts) // 3
+            if normals:
+                normal_offset += len(normals) // 3
+
+
+def write_vectorised(path, meshes, **options):
+    with ObjWriter(path, **options) as obj_file:
+        for verts, normals, faces in meshes:
+            obj_file.write_mesh(verts, faces, normals)
+
+
+def check_fixed(reference_path, path, decimals):
+    """
+    Compare a fixed precision file with the exact one line by line
+    """
+    with open(reference_path) as reference, open(path) as fixed:
+        for expected, actual in zip(reference, fixed, strict=True):
+            kind, *expected_values = expected.split()
+            actual_kind, *actual_values = actual.split()
+            if kind != actual_kind or len(expected_values) != len(actual_values):
+                return False
+            if kind == "f":
+                if expected_values != actual_values:
+                    return False
+            elif not np.allclose(np.array(expected_values, dtype=float), np.array(actual_values, dtype=float),
+                                 rtol=0, atol=0.51 * 10 ** -decimals):
+                return False
+    return True
+
+
+def timed(function, *args, iterations, **kwargs):
+    durations = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        function(*args, **kwargs)
+        durations.append(time.perf_counter() - started)
+    return min(durations)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OBJ writing")
+    parser.add_argument("--ifc", default=DEFAULT_IFC, help="IFC file whose meshes are written")
+    parser.add_argument("--synthetic-vertices", type=int, help="Write random meshes with this many vertices instead")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for --synthetic-vertices")
+    parser.add_argument("--repeat", type=int, default=1, help="Write the meshes this many times per file")
+    parser.add_argument("--iterations", type=int, default=3, help="Runs per writer, the fastest counts")
+    parser.add_argument("--precision", type=int, default=DEFAULT_PRECISION)
+    parser.add_argument("--target", type=float, default=5.0, help="Required speedup of the fixed precision writer")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    args = parser.parse_args()
+
+    if args.synthetic_vertices:
+        meshes = synthetic_meshes(args.synthetic_vertices, args.seed)
+        source = f"synthetic-{args.synthetic_vertices}"
+    else:
+        meshes = ifc_meshes(args.ifc)
+        source = os.path.basename(args.ifc)
+    meshes = meshes * args.repeat
+
+    workdir = tempfile.mkdtemp(prefix="bim-bench-obj-")
+    try:
+        paths = {name: os.path.join(workdir, f"{name}.obj") for name in ("legacy", "exact", "fixed")}
+        paths["gzip"] = os.path.join(workdir, "gzip.obj.gz")
+        seconds = {
+            "legacy": timed(write_legacy, paths["legacy"], as_tuples(meshes), iterations=args.iterations),
+            "exact": timed(write_vectorised, paths["exact"], meshes, precision=None, iterations=args.iterations),
+            "fixed": timed(write_vectorised, paths["fixed"], meshes, precision=args.precision,
+                           iterations=args.iterations),
+            "gzip": timed(write_vectorised, paths["gzip"], meshes, precision=args.precision,
+                          iterations=args.iterations),
+        }
+        with open(paths["legacy"], "rb") as legacy, open(paths["exact"], "rb") as exact:
+            exact_matches = legacy.read() == exact.read()
+        fixed_matches = check_fixed(paths["legacy"], paths["fixed"], args.precision)
+        with gzip.open(paths["gzip"]) as compressed, open(paths["fixed"], "rb") as fixed:
+            gzip_matches = compressed.read() == fixed.read()
+        sizes = {name: os.path.getsize(path) for name, path in paths.items()}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "source": source,
+        "meshes": len(meshes),
+        "vertices": sum(len(verts) for verts, _, _ in meshes),
+        "triangles": sum(len(faces) for _, _, faces in meshes),
+        "precision": args.precision,
+        "results": {
+            name: {
+                "seconds": round(duration, 4),
+                "speedup": round(seconds["legacy"] / duration, 2),
+                "size_bytes": sizes[name],
+            }
+            for name, duration in seconds.items()
+        },
+        "output_matches": {"exact": exact_matches, "fixed": fixed_matches, "gzip": gzip_matches},
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if not all(report["output_matches"].values()):
+        sys.exit("OBJ writer output differs from the legacy writer")
+    if report["results"]["fixed"]["speedup"] < args.target:
+        sys.exit(f"Fixed precision writer is {report['results']['fixed']['speedup']}x faster, "
+                 f"below the {args.target}x target")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Check the import time of the API (main:app) and the functions.py CLI against a budget.
+
+Each target is imported in a fresh interpreter with -X importtime, several
+times, and the median cumulative import time is compared with its budget.
+Heavy dependencies that should only load on first use (NumPy, IfcOpenShell,
+the converter, boto3) must not be imported at all. The exit status is non-zero
+if a target is over budget or loads one of them:
+
+    python benchmarks/bench_startup.py --output startup.json
+    python benchmarks/bench_startup.py --runs 10 --budget main=1200 --budget cli=250
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Module imported for each target and its default budget in milliseconds
+TARGETS = {
+    "main": ("main", 1500.0),
+    "cli": ("functions", 400.0),
+}
+# Modules that are loaded on first use and must stay out of startup
+DEFERRED_MODULES = ("numpy", "ifcopenshell", "converter", "geometry_index", "bvh", "obj_writer", "boto3")
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def scratch_environment(workdir):
+    """
+    Point the app's directories, database and lock files at a scratch directory
+    """
+    return {
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "CONVERTED_DIR": os.path.join(workdir, "converted"),
+        "LOCK_DIR": os.path.join(workdir, "locks"),
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+    }
+
+
+def import_once(module, workdir, env):
+    """
+    Import a module in a new interpreter. Returns the names of all loaded modules,
+    the cumulative import time of the module and of each of its direct imports in milliseconds.
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=workdir,
+                               env=env, capture_output=True, text=True)
+    if completed.returncode:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr}")
+    loaded = set()
+    children = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, name = match.groups()
+        depth = len(indent) // 2
+        loaded.add(name)
+        # Imports are printed after everything they imported, a top level line closes a group
+        if depth == 0 and name == module:
+            return loaded, int(cumulative) / 1000, children
+        if depth == 0:
+            children = {}
+        elif depth == 1:
+            children[name] = int(cumulative) / 1000
+    raise RuntimeError(f"No import time reported for {module}")
+
+
+def measure(module, runs, workdir, env, top):
+    totals = []
+    children = {}
+    loaded = set()
+    for _ in range(runs):
+        modules, total, direct = import_once(module, workdir, env)
+        totals.append(total)
+        loaded.update(modules)
+        # Direct imports of the target, the first place to look when it gets slower
+        for name, milliseconds in direct.items():
+            children.setdefault(name, []).append(milliseconds)
+    slowest = sorted(((statistics.median(times), name) for name, times in children.items()), reverse=True)
+    return {
+        "module": module,
+        "median_ms": round(statistics.median(totals), 1),
+        "min_ms": round(min(totals), 1),
+        "max_ms": round(max(totals), 1),
+        "slowest_imports": {name: round(ms, 1) for ms, name in slowest[:top]},
+        "deferred_imported": sorted(name for name in DEFERRED_MODULES if name in loaded),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check startup import time against a budget")
+    parser.add_argument("--targets", nargs="+", choices=list(TARGETS), default=list(TARGETS))
+    parser.add_argument("--runs", type=int, default=5, help="Imports per target, the median counts")
+    parser.add_argument("--budget", action="append", default=[], metavar="TARGET=MS",
+                        help="Override the budget of a target in milliseconds")
+    parser.add_argument("--top", type=int, default=8, help="Slowest direct imports listed per target")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    args = parser.parse_args()
+
+    budgets = {name: budget for name, (_, budget) in TARGETS.items()}
+    for override in args.budget:
+        name, _, milliseconds = override.partition("=")
+        if name not in budgets:
+            parser.error(f"Unknown target in --budget: {name}")
+        budgets[name] = float(milliseconds)
+
+    workdir = tempfile.mkdtemp(prefix="bim-bench-startup-")
+    try:
+        # main logs to unused/ below the working directory
+        os.makedirs(os.path.join(workdir, "unused"))
+        env = {**os.environ, **scratch_environment(workdir),
+               "PYTHONPATH": os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")]))}
+        results = {name: measure(TARGETS[name][0], args.runs, workdir, env, args.top) for name in args.targets}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    for name, result in results.items():
+        result["budget_ms"] = budgets[name]
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": args.runs,
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    for name, result in results.items():
+        if result["median_ms"] > result["budget_ms"]:
+            failures.append(f"{name} imports in {result['median_ms']} ms, over its {result['budget_ms']} ms budget")
+        if result["deferred_imported"]:
+            failures.append(f"{name} loads {', '.join(result['deferred_imported'])} at startup")
+    if failures:
+        sys.exit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Generate synthetic IFC4 models for scale testing the converter and the API.
+
+The model has one site and building with the requested number of storeys.
+Every storey is filled with walls, slabs, columns and beams laid out on a
+grid; each element instances the box geometry of one of the generated types
+through a mapped item and carries its own property sets. The same seed and
+options always produce the same file, GlobalIds and header included:
+
+    python benchmarks/generate_ifc.py large.ifc --storeys 40 --elements-per-storey 25000 --seed 7
+
+Roughly 1.6 KB are written per element with the default property sets,
+so about 650,000 elements give a 1 GB file. The whole model is built in
+memory by IfcOpenShell before writing, plan RAM accordingly.
+"""
+import argparse
+import math
+import os
+import random
+import time
+import uuid
+
+import ifcopenshell
+import ifcopenshell.api.aggregate
+import ifcopenshell.api.context
+import ifcopenshell.api.root
+import ifcopenshell.api.unit
+import ifcopenshell.guid
+
+# Element class, type class and box dimensions range (x, y, z) in metres
+ELEMENT_KINDS = (
+    ("IfcWall", "IfcWallType", ((2.0, 6.0), (0.1, 0.4), (2.5, 3.5))),
+    ("IfcSlab", "IfcSlabType", ((3.0, 8.0), (3.0, 8.0), (0.15, 0.3))),
+    ("IfcColumn", "IfcColumnType", ((0.3, 0.6), (0.3, 0.6), (2.5, 3.5))),
+    ("IfcBeam", "IfcBeamType", ((3.0, 8.0), (0.2, 0.4), (0.3, 0.6))),
+)
+STOREY_HEIGHT = 3.5
+GRID_SPACING = 8.0
+FIXED_TIMESTAMP = "2024-01-01T00:00:00"
+
+
+class SyntheticModel:
+    def __init__(self, seed):
+        """
+        Build an IFC model whose contents depend only on the seed and options
+        """
+        self.rng = random.Random(seed)
+        self.file = ifcopenshell.file(schema="IFC4")
+        self.origin = self.file.createIfcCartesianPoint((0.0, 0.0, 0.0))
+        self.identity = self.file.createIfcAxis2Placement3D(self.origin, None, None)
+
+    def guid(self):
+        return ifcopenshell.guid.compress(uuid.UUID(int=self.rng.getrandbits(128)).hex)
+
+    def placement(self, relative_to, x=0.0, y=0.0, z=0.0):
+        point = self.file.createIfcCartesianPoint((float(x), float(y), float(z)))
+        return self.file.createIfcLocalPlacement(relative_to, self.file.createIfcAxis2Placement3D(point, None, None))
+
+    def build_structure(self, storeys):
+        api = ifcopenshell.api
+        project = api.root.create_entity(self.file, ifc_class="IfcProject", name="Synthetic Project")
+        api.unit.assign_unit(self.file)
+        model = api.context.add_context(self.file, context_type="Model")
+        self.body = api.context.add_context(self.file, context_type="Model", context_identifier="Body",
+                                            target_view="MODEL_VIEW", parent=model)
+        site = api.root.create_entity(self.file, ifc_class="IfcSite", name="Site")
+        building = api.root.create_entity(self.file, ifc_class="IfcBuilding", name="Building")
+        api.aggregate.assign_object(self.file, products=[site], relating_object=project)
+        api.aggregate.assign_object(self.file, products=[building], relating_object=site)
+        site.ObjectPlacement = self.placement(None)
+        building.ObjectPlacement = self.placement(site.ObjectPlacement)
+
+        self.storeys = []
+        for level in range(storeys):
+            storey = api.root.create_entity(self.file, ifc_class="IfcBuildingStorey", name=f"Level {level}")
+            storey.Elevation = level * STOREY_HEIGHT
+            storey.ObjectPlacement = self.placement(building.ObjectPlacement, z=level * STOREY_HEIGHT)
+            self.storeys.append(storey)
+        api.aggregate.assign_object(self.file, products=self.storeys, relating_object=building)
+
+        # The API generates random GlobalIds, replace them in creation order
+        for entity in sorted(self.file.by_type("IfcRoot"), key=lambda e: e.id()):
+            entity.GlobalId = self.guid()
+
+    def box_solid(self, x, y, z):
+        profile = self.file.createIfcRectangleProfileDef("AREA", None, None, x, y)
+        direction = self.file.createIfcDirection((0.0, 0.0, 1.0))
+        return self.file.createIfcExtrudedAreaSolid(profile, self.identity, direction, z)
+
+    def build_types(self, count):
+        """
+        Create element types, each with a box representation map and a shared property set
+        """
+        self.types = []
+        for index in range(count):
+            element_class, type_class, dimensions = ELEMENT_KINDS[index % len(ELEMENT_KINDS)]
+            size = [round(self.rng.uniform(low, high), 3) for low, high in dimensions]
+            representation = self.file.createIfcShapeRepresentation(
+                self.body, "Body", "SweptSolid", [self.box_solid(*size)])
+            representation_map = self.file.createIfcRepresentationMap(self.identity, representation)
+            pset = self.property_set(f"Pset_{type_class[3:]}Common", 3)
+            element_type = self.file.create_entity(
+                type_class, GlobalId=self.guid(), Name=f"{type_class[3:]} {index}",
+                HasPropertySets=[pset], RepresentationMaps=[representation_map], PredefinedType="NOTDEFINED")
+            self.types.append((element_class, element_type, representation_map))
+
+    def property_set(self, name, properties):
+        values = []
+        for index in range(properties):
+            if index % 3 == 0:
+                value = self.file.createIfcLabel(f"Value {self.rng.randrange(1000)}")
+            elif index % 3 == 1:
+                value = self.file.createIfcReal(round(self.rng.uniform(0, 100), 3))
+            else:
+                value = self.file.createIfcBoolean(self.rng.random() < 0.5)
+            values.append(self.file.createIfcPropertySingleValue(f"Property{index}", None, value, None))
+        return self.file.createIfcPropertySet(self.guid(), None, name, None, values)
+
+    def build_elements(self, per_storey, psets, properties):
+        transform = self.file.createIfcCartesianTransformationOperator3D(None, None, self.origin, None, None)
+        columns = max(1, math.ceil(math.sqrt(per_storey)))
+        typed = {element_type: [] for _, element_type, _ in self.types}
+        total = 0
+        for storey in self.storeys:
+            contained = []
+            for index in range(per_storey):
+                element_class, element_type, representation_map = self.types[self.rng.randrange(len(self.types))]
+                x = (index % columns) * GRID_SPACING + self.rng.uniform(-0.5, 0.5)
+                y = (index // columns) * GRID_SPACING + self.rng.uniform(-0.5, 0.5)
+                item = self.file.createIfcMappedItem(representation_map, transform)
+                shape = self.file.createIfcProductDefinitionShape(None, None, [
+                    self.file.createIfcShapeRepresentation(self.body, "Body", "MappedRepresentation", [item])])
+                element = self.file.create_entity(
+                    element_class, GlobalId=self.guid(), Name=f"{element_class[3:]} {total}",
+                    ObjectPlacement=self.placement(storey.ObjectPlacement, x, y), Representation=shape)
+                for number in range(psets):
+                    self.file.createIfcRelDefinesByProperties(
+                        self.guid(), None, None, None, [element],
+                        self.property_set(f"Pset_Synthetic{number}", properties))
+                contained.append(element)
+                typed[element_type].append(element)
+                total += 1
+            if contained:
+                self.file.createIfcRelContainedInSpatialStructure(self.guid(), None, None, None, contained, storey)
+        for element_type, elements in typed.items():
+            if elements:
+                self.file.createIfcRelDefinesByType(self.guid(), None, None, None, elements, element_type)
+        return total
+
+    def write(self, path):
+        header = self.file.header
+        header.file_name.name = os.path.basename(path)
+        header.file_name.time_stamp = FIXED_TIMESTAMP
+        header.file_name.originating_system = "bim-viewer synthetic IFC generator"
+        self.file.write(path)
+
+
+def generate(path, storeys=5, elements_per_storey=200, types=8, psets=2, properties=6, seed=0):
+    """
+    Write a synthetic IFC file and return the number of generated elements
+    """
+    model = SyntheticModel(seed)
+    model.build_structure(storeys)
+    model.build_types(types)
+    elements = model.build_elements(elements_per_storey, psets, properties)
+    model.write(path)
+    return elements
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic IFC model")
+    parser.add_argument("output", help="Path of the IFC file to write")
+    parser.add_argument("--storeys", type=int, default=5)
+    parser.add_argument("--elements-per-storey", type=int, default=200)
+    parser.add_argument("--types", type=int, default=8, help="Number of distinct element types")
+    parser.add_argument("--psets", type=int, default=2, help="Property sets per element")
+    parser.add_argument("--properties", type=int, default=6, help="Properties per property set")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    elements = generate(args.output, args.storeys, args.elements_per_storey, args.types, args.psets,
+                        args.properties, args.seed)
+    size = os.path.getsize(args.output)
+    print(f"Wrote {elements} elements to {args.output} ({size / 1024 / 1024:.1f} MB, "
+          f"{size / max(elements, 1):.0f} bytes per element) in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import os
+
+import numpy as np
+
+# Maximum number of elements in a leaf node
+LEAF_SIZE = 4
+
+NODE_DTYPE = np.dtype([
+    # min x, min y, min z, max x, max y, max z of everything below the node
+    ("bbox", "<f4", (6,)),
+    # Child node numbers, -1 for leaves
+    ("left", "<i4"),
+    ("right", "<i4"),
+    # Range of the node's elements in the item array
+    ("start", "<u4"),
+    ("count", "<u4"),
+])
+
+ITEM_DTYPE = np.dtype([
+    # Row of the element in the geometry index
+    ("element", "<u4"),
+    ("bbox", "<f4", (6,)),
+])
+
+
+def bvh_paths(index_path):
+    """
+    Paths of the node and item arrays of the hierarchy stored next to a geometry index
+    """
+    base = index_path[:-len(".idx.npy")] if index_path.endswith(".idx.npy") else index_path
+    return f"{base}.bvh.npy", f"{base}.bvh-items.npy"
+
+
+def build_bvh(bboxes, leaf_size=LEAF_SIZE):
+    """
+    Build a bounding volume hierarchy over element bounding boxes by splitting
+    at the median centroid along the longest axis. Every subtree covers a
+    contiguous range of the returned item array.
+    """
+    bboxes = np.asarray(bboxes, dtype=np.float32).reshape(-1, 6)
+    order = np.arange(len(bboxes), dtype=np.uint32)
+    centroids = (bboxes[:, :3] + bboxes[:, 3:]) / 2
+    nodes = []
+    if len(bboxes):
+        nodes.append(None)
+        stack = [(0, 0, len(bboxes))]
+    else:
+        stack = []
+    while stack:
+        node, start, end = stack.pop()
+        members = order[start:end]
+        bbox = np.concatenate([bboxes[members, :3].min(axis=0), bboxes[members, 3:].max(axis=0)])
+        if end - start <= leaf_size:
+            nodes[node] = (bbox, -1, -1, start, end - start)
+            continue
+        spread = centroids[members].max(axis=0) - centroids[members].min(axis=0)
+        axis = int(np.argmax(spread))
+        middle = (end - start) // 2
+        order[start:end] = members[np.argpartition(centroids[members, axis], middle)]
+        left, right = len(nodes), len(nodes) + 1
+        nodes.extend((None, None))
+        nodes[node] = (bbox, left, right, start, end - start)
+        stack.append((right, start + middle, end))
+        stack.append((left, start, start + middle))
+
+    items = np.empty(len(order), dtype=ITEM_DTYPE)
+    items["element"] = order
+    items["bbox"] = bboxes[order]
+    return np.array(nodes, dtype=NODE_DTYPE), items
+
+
+def write_bvh(bboxes, index_path):
+    """
+    Build the hierarchy for the elements of a geometry index and store it next to the index
+    """
+    nodes, items = build_bvh(bboxes)
+    for path, array in zip(bvh_paths(index_path), (nodes, items)):
+        with open(f"{path}.part", "wb") as file:
+            np.save(file, array)
+        os.replace(f"{path}.part", path)
+    return len(nodes)
+
+
+def point_box_distance(point, bboxes):
+    """
+    Distance from a point to each box, 0 for boxes containing it
+    """
+    gap = np.maximum(np.maximum(bboxes[:, :3] - point, point - bboxes[:, 3:]), 0)
+    return np.sqrt((gap ** 2).sum(axis=1))
+
+
+def ray_box_distance(origin, direction, bboxes):
+    """
+    Distance along a normalised ray to where it enters each box, inf for boxes it misses
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inverse = 1 / direction
+        near = (bboxes[:, :3] - origin) * inverse
+        far = (bboxes[:, 3:] - origin) * inverse
+    # nan appears for rays parallel to a face lying exactly in it, fmin/fmax skip it
+    entry = np.fmax.reduce(np.fmin(near, far), axis=1)
+    exit = np.fmin.reduce(np.fmax(near, far), axis=1)
+    hit = exit >= np.maximum(entry, 0)
+    return np.where(hit, np.maximum(entry, 0), np.inf)
+
+
+def ray_mesh_distance(origin, direction, vertices, triangles, epsilon=1e-9):
+    """
+    Distance along a normalised ray to the closest triangle of a mesh, inf if
+    it misses, using a vectorised Moller-Trumbore intersection test
+    """
+    if len(triangles) == 0:
+        return np.inf
+    vertices = np.asarray(vertices, dtype=np.float64)
+    corners = vertices[np.asarray(triangles).reshape(-1, 3)]
+    edge1 = corners[:, 1] - corners[:, 0]
+    edge2 = corners[:, 2] - corners[:, 0]
+    p = np.cross(direction, edge2)
+    determinant = (edge1 * p).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inverse = 1 / determinant
+        s = origin - corners[:, 0]
+        u = (s * p).sum(axis=1) * inverse
+        q = np.cross(s, edge1)
+        v = (direction * q).sum(axis=1) * inverse
+        t = (edge2 * q).sum(axis=1) * inverse
+        hit = (np.abs(determinant) > epsilon) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+    return float(t[hit].min()) if hit.any() else np.inf
+
+
+class BVH:
+    def __init__(self, nodes_path, items_path):
+        """
+        Memory-mapped hierarchy of one model. Queries walk the tree one level at
+        a time, testing the whole level with a few array operations.
+        """
+        self.nodes = np.load(nodes_path, mmap_mode="r")
+        self.items = np.load(items_path, mmap_mode="r")
+        # Field views of the mapping, looked up once instead of on every level
+        self.bboxes, self.left, self.right = self.nodes["bbox"], self.nodes["left"], self.nodes["right"]
+        self.starts, self.counts = self.nodes["start"], self.nodes["count"]
+
+    def _walk(self, visit):
+        """
+        Return the items of all leaves whose box passes visit(node numbers, boxes),
+        which returns a mask of the nodes to descend into
+        """
+        if len(self.nodes) == 0:
+            return self.items[:0]
+        frontier = np.zeros(1, dtype=np.int64)
+        leaves = []
+        while frontier.size:
+            frontier = frontier[visit(frontier, self.bboxes[frontier])]
+            left = self.left[frontier]
+            is_leaf = left < 0
+            leaves.append(frontier[is_leaf])
+            frontier = np.concatenate([left[~is_leaf], self.right[frontier[~is_leaf]]])
+        return self._leaf_items(np.concatenate(leaves))
+
+    def _leaf_items(self, leaves):
+        starts = self.starts[leaves].astype(np.int64)
+        counts = self.counts[leaves].astype(np.int64)
+        # Consecutive item numbers of every leaf range, without a Python loop
+        first = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return self.items[first + np.arange(counts.sum())]
+
+    def box(self, minimum, maximum):
+        """
+        Items of elements whose bounding box intersects the query box
+        """
+        query = np.concatenate([minimum, maximum]).astype(np.float32)
+
+        def overlaps(frontier, bboxes):
+            return (bboxes[:, :3] <= query[3:]).all(axis=1) & (bboxes[:, 3:] >= query[:3]).all(axis=1)
+
+        items = self._walk(overlaps)
+        return items[overlaps(None, items["bbox"])]
+
+    def nearest(self, point, k=1):
+        """
+        Items and distances of the k elements whose bounding boxes are closest to the point
+        """
+        point = np.asarray(point, dtype=np.float64)
+        found = {"distances": np.empty(0)}
+
+        def bound(frontier, bboxes):
+            # Any node is guaranteed to hold its count of elements within its farthest corner
+            farthest = np.sqrt((np.maximum(np.abs(bboxes[:, :3] - point), np.abs(bboxes[:, 3:] - point)) ** 2)
+                               .sum(axis=1))
+            distances = np.concatenate([farthest, found["distances"]])
+            counts = np.concatenate([self.counts[frontier], np.ones(len(found["distances"]))])
+            order = np.argsort(distances)
+            enough = np.searchsorted(np.cumsum(counts[order]), k)
+            return distances[order[enough]] if enough < len(order) else np.inf
+
+        def closer(frontier, bboxes):
+            mask = point_box_distance(point, bboxes) <= bound(frontier, bboxes)
+            # Leaves passing the bound are resolved to exact element distances right away
+            leaves = frontier[mask & (self.left[frontier] < 0)]
+            if leaves.size:
+                items = self._leaf_items(leaves)
+                found["distances"] = np.concatenate([found["distances"], point_box_distance(point, items["bbox"])])
+            return mask
+
+        items = self._walk(closer)
+        distances = point_box_distance(point, items["bbox"])
+        order = np.argsort(distances, kind="stable")[:k]
+        return items[order], distances[order]
+
+    def ray(self, origin, direction, max_distance=np.inf):
+        """
+        Items and entry distances of elements whose bounding box the ray hits, closest first
+        """
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        direction = direction / np.linalg.norm(direction)
+
+        def hits(frontier, bboxes):
+            distances = ray_box_distance(origin, direction, bboxes)
+            return np.isfinite(distances) & (distances <= max_distance)
+
+        items = self._walk(hits)
+        distances = ray_box_distance(origin, direction, items["bbox"])
+        order = np.argsort(distances, kind="stable")
+        order = order[hits(None, items["bbox"][order])]
+        return items[order], distances[order]
@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from sqlalchemy import select
+
+from database import Session
+from models import FileModel
+
+
+def record_upload(folder, ifc_filename, img_filename, scan):
+    """
+    Store an upload and its pre-scan results, replacing an earlier upload of the same folder
+    """
+    with Session() as session:
+        entry = session.scalars(select(FileModel).where(FileModel.folder == folder)).first()
+        if entry is None:
+            entry = FileModel(folder=folder)
+            session.add(entry)
+        entry.ifc_filename = ifc_filename
+        entry.img_filename = img_filename
+        entry.upload_time = datetime.now()
+        entry.size_bytes = scan["size_bytes"]
+        entry.schema = scan["schema"]
+        entry.originating_system = scan["originating_system"]
+        entry.entity_count = scan["entity_count"]
+        entry.entity_types = scan["entity_types"]
+        entry.header = scan["header"]
+        session.commit()
+        return entry.to_dict()
+
+
+def get_upload(folder):
+    with Session() as session:
+        entry = session.scalars(select(FileModel).where(FileModel.folder == folder)).first()
+        return entry.to_dict() if entry else None
+
+
+def delete_upload(folder):
+    with Session() as session:
+        entry = session.scalars(select(FileModel).where(FileModel.folder == folder)).first()
+        if entry is not None:
+            session.delete(entry)
+            session.commit()
@@ -1,7 +1,14 @@
-
 import logging
 import os
+import re
 import subprocess
+import threading
+import time
+import uuid
+
+from bvh import bvh_paths
+from geometry_index import build_geometry_index, geometry_paths
+from metrics import CONVERSION_PHASE_DURATION, record_span, span
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -13,6 +20,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# IfcConvert prints a progress bar ending in a percentage and a summary line
+# with the number of processed objects once geometry creation is done
+PROGRESS_PATTERN = re.compile(r"(\d{1,3})\s*%")
+OBJECTS_PATTERN = re.compile(r"\((\d+) objects\)")
+# Lines announcing the start of a stage mapped to the conversion phase they begin
+STAGE_MARKERS = (("scanning file", "parse"), ("creating geometry", "tessellate"), ("writing output", "write"))
+
+# How often a running conversion checks for cancellation and timeouts (seconds)
+POLL_INTERVAL = 0.2
+
+
+class ConversionCancelled(Exception):
+    pass
+
+
+class ConversionTimeout(Exception):
+    pass
+
 
 class IFCConverter:
     def __init__(self, input_dir="local store", output_dir="converted"):
@@ -28,9 +53,14 @@ class IFCConverter:
         for directory in [self.output_dir, self.obj_dir, self.xml_dir]:
             os.makedirs(directory, exist_ok=True)
 
-    def convert_file(self,filename):
+    def convert_file(self, filename, timeout=None, cancel_event=None, progress_callback=None):
         """
         Convert an IFC file to OBJ and XML formats using an external IFC converter.
+
+        :param timeout: Maximum number of seconds the whole conversion may take
+        :param cancel_event: threading.Event which aborts the conversion when set
+        :param progress_callback: Called as progress_callback(phase, progress, elements)
+            where progress is between 0 and 1 and elements is the processed object count if known
         """
         # Paths
         ifc_converter_path = os.path.join(SCRIPT_DIR, "IfcConvert.exe")  # Path to the converter executable
@@ -38,26 +68,49 @@ class IFCConverter:
         logger.info(f"Converting {filename} to OBJ and XML")
         logger.info(f"IFC coverter path: {ifc_converter_path}")
         logger.info(f"Input file path: {input_file_path}")
-        obj_output = os.path.join(self.obj_dir, f"{os.path.splitext(filename)[0]}.obj")
-        xml_output = os.path.join(self.xml_dir, f"{os.path.splitext(filename)[0]}.xml")
+        model = os.path.splitext(filename)[0]
+        obj_output = os.path.join(self.obj_dir, f"{model}.obj")
+        xml_output = os.path.join(self.xml_dir, f"{model}.xml")
         logger.info(f"OBJ output file path: {obj_output}")
         logger.info(f"XML output file path: {xml_output}")
+        geometry_output, index_output = geometry_paths(self.output_dir, model)
+
+        # Everything is written under names of this run and only moved into place once
+        # the whole conversion succeeded, so a failed run leaves the previous result intact
+        run = uuid.uuid4().hex[:8]
+        obj_staged = os.path.join(self.obj_dir, f"{model}.{run}.obj")
+        xml_staged = os.path.join(self.xml_dir, f"{model}.{run}.xml")
+        geometry_staged, index_staged = geometry_paths(self.output_dir, f"{model}.{run}")
+        # The index goes last, readers reload a model when its index changes
+        outputs = [(obj_staged, obj_output), (xml_staged, xml_output), (geometry_staged, geometry_output),
+                   *zip(bvh_paths(index_staged), bvh_paths(index_output)), (index_staged, index_output)]
+        deadline = time.monotonic() + timeout if timeout else None
+        phases = [
+            ("obj", [input_file_path, obj_staged, "--use-element-guids"]),
+            ("xml", [input_file_path, xml_staged]),
+        ]
         try:
-            # Run the converter for OBJ format
-            subprocess.run(
-                ["docker", "run", "aecgeeks/ifcopenshell", "IfcConvert", input_file_path, obj_output,
-                 "--use-element-guids"],
-                check=True
-            )# Run the converter for XML format (if applicable)
-            logger.info("ASD")
-            subprocess.run(
-                ["docker", "run", "aecgeeks/ifcopenshell", "IfcConvert", input_file_path, xml_output],
-                check=True
-            )
+            # Run the converter for OBJ format, then for XML format
+            started = time.perf_counter()
+            for index, (phase, arguments) in enumerate(phases):
+                def report(progress, elements=None, phase=phase, index=index):
+                    if progress_callback:
+                        progress_callback(phase, (index + progress) / len(phases), elements)
+
+                report(0.0)
+                self._run_ifcconvert(arguments, deadline, cancel_event, report, phase)
+                report(1.0)
+                if phase == "obj":
+                    indexed = self._build_index(obj_staged, geometry_staged, index_staged)
+            self._publish(outputs)
+            # Only complete conversions count, aborted ones would skew the distribution
+            record_span("conversion", time.perf_counter() - started, CONVERSION_PHASE_DURATION, phase="total")
             return {
                 "status": "success",
                 "obj_path": obj_output,
-                "xml_path": xml_output
+                "xml_path": xml_output,
+                "geometry_path": geometry_output if indexed is not None else None,
+                "indexed_elements": indexed
             }
 
         except subprocess.CalledProcessError as e:
@@ -65,9 +118,126 @@ class IFCConverter:
                 "status": "failure",
                 "message": f"Conversion failed: {e}"
             }
+        except ConversionCancelled:
+            logger.info(f"Conversion of {filename} cancelled")
+            return {
+                "status": "cancelled",
+                "message": "Conversion cancelled"
+            }
+        except ConversionTimeout:
+            logger.warning(f"Conversion of {filename} timed out after {timeout} seconds")
+            return {
+                "status": "timeout",
+                "message": f"Conversion timed out after {timeout} seconds"
+            }
         except FileNotFoundError:
-            logger.info(FileNotFoundError, subprocess.CompletedProcess)
+            logger.error("IFC converter executable not found.")
             return {
                 "status": "failure",
                 "message": "IFC converter executable not found."
-            }
\ No newline at end of file
+            }
+        finally:
+            # Whatever this run left behind: staged files not moved into place, the .tmp
+            # files IfcConvert writes before renaming and the .part files of the index
+            self._remove_outputs(*(staged + suffix for staged, _ in outputs for suffix in ("", ".tmp", ".part")))
+
+    def _run_ifcconvert(self, arguments, deadline, cancel_event, report, output_format):
+        """
+        Run IfcConvert in a container, forwarding its progress output to report()
+        and killing the container as soon as the job is cancelled or times out.
+        """
+        container_name = f"ifcconvert-{uuid.uuid4().hex}"
+        command = ["docker", "run", "--rm", "--name", container_name,
+                   "aecgeeks/ifcopenshell", "IfcConvert", *arguments]
+        stage = {"phase": "container_start", "start": time.perf_counter()}
+
+        def on_stage(phase):
+            # Close the running stage and time the next one
+            now = time.perf_counter()
+            if stage["phase"] is not None:
+                record_span("conversion.phase", now - stage["start"], CONVERSION_PHASE_DURATION,
+                            phase=stage["phase"])
+            if phase == "write":
+                phase = f"write_{output_format}"
+            stage.update(phase=phase, start=now)
+
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        reader = threading.Thread(target=self._read_progress, args=(process.stdout, report, on_stage),
+                                  daemon=True)
+        reader.start()
+        try:
+            while process.poll() is None:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ConversionCancelled()
+                if deadline is not None and time.monotonic() > deadline:
+                    raise ConversionTimeout()
+                time.sleep(POLL_INTERVAL)
+        except (ConversionCancelled, ConversionTimeout):
+            self._kill(process, container_name)
+            raise
+        finally:
+            reader.join(timeout=1)
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command)
+        on_stage(None)
+
+    @staticmethod
+    def _build_index(obj_path, geometry_path, index_path):
+        """
+        Split the OBJ into per-element meshes for the geometry endpoint. The
+        conversion still succeeds without an index, elements just cannot be fetched one by one.
+        """
+        try:
+            with span("conversion.phase", CONVERSION_PHASE_DURATION, phase="index"):
+                return build_geometry_index(obj_path, geometry_path, index_path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not index geometry of {obj_path}: {str(e)}")
+            return None
+
+    @staticmethod
+    def _publish(outputs):
+        """
+        Move the staged outputs of a successful run over the previous ones. Outputs
+        this run did not produce, like a failed index, are removed rather than
+        left behind from an earlier conversion.
+        """
+        for staged, output in outputs:
+            if os.path.exists(staged):
+                os.replace(staged, output)
+            elif os.path.exists(output):
+                os.remove(output)
+
+    @staticmethod
+    def _read_progress(stream, report, on_stage):
+        """
+        Parse the stage announcements and the progress bar IfcConvert redraws with carriage returns
+        """
+        buffer = ""
+        for chunk in iter(lambda: stream.read1(4096), b""):
+            buffer += chunk.decode(errors="replace")
+            *lines, buffer = re.split(r"[\r\n]", buffer)
+            for line in lines:
+                for marker, phase in STAGE_MARKERS:
+                    if line.strip().lower().startswith(marker):
+                        on_stage(phase)
+                objects = OBJECTS_PATTERN.search(line)
+                if objects:
+                    report(1.0, int(objects.group(1)))
+                    continue
+                percentage = PROGRESS_PATTERN.search(line)
+                if percentage:
+                    report(min(int(percentage.group(1)), 100) / 100)
+
+    @staticmethod
+    def _kill(process, container_name):
+        # Killing the docker client alone leaves the container running
+        subprocess.run(["docker", "kill", container_name],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        process.kill()
+        process.wait()
+
+    @staticmethod
+    def _remove_outputs(*paths):
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
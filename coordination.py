@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+import re
+from contextlib import asynccontextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# Lock files live on a filesystem every worker process shares
+LOCK_DIR = os.environ.get("LOCK_DIR", "locks")
+# How often a waiting coroutine retries a held lock (seconds)
+LOCK_POLL_INTERVAL = 0.05
+
+
+class FileLock:
+    def __init__(self, name, lock_dir=None):
+        """
+        An exclusive lock held through a lock file, honoured across processes.
+        Each instance opens its own file, so it also excludes other threads of this process.
+        """
+        self.lock_dir = lock_dir or LOCK_DIR
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+        self.path = os.path.join(self.lock_dir, f"{safe_name}.lock")
+        self.file = None
+
+    def acquire(self, blocking=True, shared=False):
+        """
+        Take the lock. With blocking=False returns False right away if it is held elsewhere.
+        Shared locks can be held by several readers at once where the platform supports it.
+        """
+        # Created on first use, so importing the app has no side effects on disk
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self.file = open(self.path, "a+b")
+        try:
+            if fcntl is not None:
+                mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+                fcntl.flock(self.file.fileno(), mode | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                # msvcrt only has exclusive locks
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            self.file.close()
+            self.file = None
+            if blocking:
+                raise
+            return False
+
+    def release(self):
+        if self.file is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
+
+    @property
+    def held(self):
+        return self.file is not None
+
+
+@asynccontextmanager
+async def folder_lock(folder, shared=False):
+    """
+    Serialise changes to one folder across all workers. Readers such as
+    downloads take a shared lock and only wait for uploads and deletes.
+    """
+    lock = FileLock(f"folder-{folder}")
+    # Poll instead of blocking a thread, so a cancelled request never acquires the lock later
+    while not lock.acquire(blocking=False, shared=shared):
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+class LeaderElection:
+    def __init__(self, name, retry_interval=5.0):
+        """
+        Elect a single process to run a singleton task. The leader holds a lock
+        file until it exits; the others keep retrying so one takes over if it dies.
+        """
+        self.name = name
+        self.lock = FileLock(f"leader-{name}")
+        self.retry_interval = retry_interval
+
+    @property
+    def is_leader(self):
+        return self.lock.held
+
+    async def run(self, task):
+        """
+        Wait for leadership, then run the coroutine function task until cancelled
+        """
+        try:
+            while not self.lock.acquire(blocking=False):
+                await asyncio.sleep(self.retry_interval)
+            logger.info(f"Process {os.getpid()} elected leader for {self.name}")
+            await task()
+        finally:
+            self.lock.release()
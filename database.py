@@ -0,0 +1,59 @@
+import os
+from datetime import datetime
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from coordination import FileLock
+from models import Base, StateModel
+
+# Shared by every worker process. Local SQLite file by default,
+# any SQLAlchemy URL (e.g. postgresql+psycopg://...) works
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///catalog.db")
+
+if DATABASE_URL.startswith("sqlite"):
+    # Wait for locks held by other workers instead of failing immediately
+    engine = create_engine(DATABASE_URL, connect_args={"timeout": 30, "check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _enable_wal(connection, record):
+        # WAL lets readers in one worker proceed while another one writes
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+else:
+    engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+
+Session = sessionmaker(engine, expire_on_commit=False)
+
+
+def create_tables():
+    """
+    Create missing tables, called once at startup rather than on import
+    """
+    # Workers start together, only let one of them create the tables
+    schema_lock = FileLock("database-schema")
+    schema_lock.acquire()
+    try:
+        Base.metadata.create_all(engine)
+    finally:
+        schema_lock.release()
+
+
+def get_state(key, default=None):
+    """
+    Read a JSON value shared between worker processes
+    """
+    with Session() as session:
+        entry = session.get(StateModel, key)
+        return entry.value if entry is not None else default
+
+
+def set_state(key, value):
+    with Session() as session:
+        entry = session.get(StateModel, key)
+        if entry is None:
+            session.add(StateModel(key=key, value=value, updated_at=datetime.now()))
+        else:
+            entry.value = value
+            entry.updated_at = datetime.now()
+        session.commit()
@@ -4,8 +4,6 @@ import requests
 import argparse
 import os
 
-from converter import IFCConverter
-
 # Get the directory where the script is located
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -99,6 +97,9 @@ def convert_file(filename):
     """
     Convert a downloaded IFC file to OBJ and XML formats
     """
+    # Imported here so the other commands do not load the converter and its dependencies
+    from converter import IFCConverter
+
     # Initialize the converter
     converter = IFCConverter(LOCAL_STORE_DIR, os.path.join(SCRIPT_DIR, "converted"))
 
@@ -0,0 +1,222 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+
+import numpy as np
+
+from bvh import BVH, bvh_paths, ray_mesh_distance, write_bvh
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Every element record in the geometry file starts with this header, followed by
+# float32 vertex coordinates (x, y, z) and uint32 triangle vertex indices:
+#   22 byte GlobalId, 2 bytes padding, uint32 vertex count, uint32 triangle count
+RECORD_HEADER = struct.Struct("<22s2xII")
+GUID_LENGTH = 22
+
+INDEX_DTYPE = np.dtype([
+    ("guid", "S22"),
+    ("offset", "<u8"),
+    ("length", "<u8"),
+    ("triangles", "<u4"),
+    # min x, min y, min z, max x, max y, max z
+    ("bbox", "<f4", (6,)),
+])
+
+# Number of models whose index and geometry file stay mapped
+MAX_OPEN_MODELS = int(os.environ.get("MAX_OPEN_MODELS", 32))
+
+
+def geometry_paths(output_dir, model):
+    """
+    Paths of the geometry file and its index for a model converted into output_dir
+    """
+    base = os.path.join(output_dir, "geometry", model)
+    return f"{base}.bin", f"{base}.idx.npy"
+
+
+def _obj_groups(obj_file):
+    """
+    Yield (name, first vertex number, vertex lines, face indices) per group of
+    an OBJ file. Face indices are 0-based global vertex numbers, polygons are
+    split into triangles.
+    """
+    name = None
+    vertices = []
+    faces = []
+    vertex_count = 0
+    for line in obj_file:
+        if line.startswith("v "):
+            vertices.append(line[2:])
+        elif line.startswith("f "):
+            corners = [int(token.split("/", 1)[0]) for token in line[2:].split()]
+            # Negative indices count back from the last vertex read so far
+            corners = [index - 1 if index > 0 else vertex_count + len(vertices) + index for index in corners]
+            # Triangulate polygons as a fan
+            for corner in range(1, len(corners) - 1):
+                faces.extend((corners[0], corners[corner], corners[corner + 1]))
+        elif line.startswith("g ") or line.startswith("o "):
+            if name is not None or vertices:
+                yield name, vertex_count, vertices, faces
+                vertex_count += len(vertices)
+            name = line[2:].strip()
+            vertices = []
+            faces = []
+    if name is not None or vertices:
+        yield name, vertex_count, vertices, faces
+
+
+def build_geometry_index(obj_path, bin_path, index_path):
+    """
+    Split an OBJ written with --use-element-guids into one mesh record per
+    element and write a GlobalId index with byte ranges, bounding boxes and
+    triangle counts, plus a bounding volume hierarchy for spatial queries.
+    Returns the number of indexed elements.
+    """
+    os.makedirs(os.path.dirname(bin_path), exist_ok=True)
+    entries = []
+    offset = 0
+    with open(obj_path) as obj_file, open(f"{bin_path}.part", "wb") as bin_file:
+        for name, first_vertex, vertices, faces in _obj_groups(obj_file):
+            guid = (name or "").encode()
+            if len(guid) != GUID_LENGTH:
+                logger.warning(f"Skipping OBJ group {name!r} in {obj_path}, it is not a GlobalId")
+                continue
+            if not vertices or not faces:
+                continue
+            points = np.array(" ".join(vertices).split(), dtype=np.float32).reshape(-1, 3)
+            triangles = np.asarray(faces, dtype=np.int64) - first_vertex
+            if triangles.min() < 0 or triangles.max() >= len(points):
+                raise ValueError(f"Faces of {name} reference vertices outside its group")
+            triangles = triangles.astype(np.uint32)
+
+            record = (RECORD_HEADER.pack(guid, len(points), len(triangles) // 3)
+                      + points.tobytes() + triangles.tobytes())
+            bin_file.write(record)
+            bbox = np.concatenate([points.min(axis=0), points.max(axis=0)])
+            entries.append((guid, offset, len(record), len(triangles) // 3, bbox))
+            offset += len(record)
+
+    index = np.array(entries, dtype=INDEX_DTYPE)
+    # Sorted by GlobalId so lookups are a binary search
+    index.sort(order="guid")
+    with open(f"{index_path}.part", "wb") as index_file:
+        np.save(index_file, index)
+    # The index is replaced last, readers reload everything when it changes
+    write_bvh(index["bbox"], index_path)
+    os.replace(f"{bin_path}.part", bin_path)
+    os.replace(f"{index_path}.part", index_path)
+    return len(index)
+
+
+class GeometryModel:
+    def __init__(self, bin_path, index_path):
+        """
+        Memory-mapped geometry file and index of one converted model
+        """
+        self.index = np.load(index_path, mmap_mode="r")
+        self.bvh_paths = bvh_paths(index_path)
+        self._bvh = None
+        # The mapping keeps its own handle on the file. It is not closed explicitly,
+        # responses still streaming from a model the cache dropped keep it alive.
+        with open(bin_path, "rb") as f:
+            # mmap cannot map an empty file
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(bin_path) else b""
+
+    def lookup(self, global_ids):
+        """
+        Return index rows of the requested GlobalIds in request order, and the ids not found
+        """
+        if len(self.index) == 0:
+            return self.index[:0], list(global_ids)
+        encoded = [global_id.encode() for global_id in global_ids]
+        # S22 would silently cut longer ids down to an existing GlobalId
+        valid = np.array([len(key) == GUID_LENGTH for key in encoded], dtype=bool)
+        keys = np.array(encoded, dtype="S22")
+        positions = np.searchsorted(self.index["guid"], keys).clip(0, len(self.index) - 1)
+        found = valid & (self.index["guid"][positions] == keys)
+        missing = [global_id for global_id, hit in zip(global_ids, found) if not hit]
+        return self.index[positions[found]], missing
+
+    @property
+    def bvh(self):
+        """
+        Spatial hierarchy of the model, loaded on first use. None for models indexed without one.
+        """
+        if self._bvh is None and all(os.path.exists(path) for path in self.bvh_paths):
+            self._bvh = BVH(*self.bvh_paths)
+        return self._bvh
+
+    def mesh(self, row):
+        """
+        Vertices and triangle indices of the element in an index row
+        """
+        offset = int(row["offset"])
+        _, vertex_count, triangle_count = RECORD_HEADER.unpack_from(self.data, offset)
+        offset += RECORD_HEADER.size
+        # Slices of the mapping are copies, the arrays do not pin it
+        vertices = self.data[offset:offset + vertex_count * 12]
+        triangles = self.data[offset + len(vertices):offset + len(vertices) + triangle_count * 12]
+        return (np.frombuffer(vertices, np.float32).reshape(-1, 3),
+                np.frombuffer(triangles, np.uint32).reshape(-1, 3))
+
+    def pick(self, origin, direction, max_distance=np.inf, limit=1, exact=False):
+        """
+        GlobalIds and distances of the elements hit by a ray, closest first. Without
+        exact only bounding boxes are tested; with it the candidates' triangles are
+        intersected in order of their box distance until no closer hit is possible.
+        """
+        direction = np.asarray(direction, dtype=np.float64)
+        direction = direction / np.linalg.norm(direction)
+        items, distances = self.bvh.ray(origin, direction, max_distance)
+        if not exact:
+            return self.index["guid"][items["element"][:limit]], distances[:limit]
+        hits = []
+        for element, entry in zip(items["element"].tolist(), distances.tolist()):
+            if len(hits) >= limit and entry > hits[limit - 1][1]:
+                break
+            vertices, triangles = self.mesh(self.index[element])
+            distance = ray_mesh_distance(np.asarray(origin, dtype=np.float64), direction, vertices, triangles)
+            if np.isfinite(distance) and distance <= max_distance:
+                hits.append((element, distance))
+                hits.sort(key=lambda hit: hit[1])
+        hits = hits[:limit]
+        elements = np.array([element for element, _ in hits], dtype=np.int64)
+        return self.index["guid"][elements], np.array([distance for _, distance in hits])
+
+    def records(self, rows):
+        for offset, length in zip(rows["offset"].tolist(), rows["length"].tolist()):
+            yield self.data[offset:offset + length]
+
+
+class GeometryCache:
+    def __init__(self, max_models=MAX_OPEN_MODELS):
+        """
+        Keep recently used models mapped, reopening them when a conversion rewrites the files.
+        Models that are evicted or replaced are unmapped once no request uses them anymore.
+        """
+        self.max_models = max_models
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def get(self, bin_path, index_path):
+        if not os.path.exists(bin_path) or not os.path.exists(index_path):
+            return None
+        key = (bin_path, index_path)
+        version = os.stat(index_path).st_mtime_ns
+        with self.lock:
+            cached = self.models.pop(key, None)
+            if cached is not None and cached[0] == version:
+                CACHE_REQUESTS.inc(cache="geometry", result="hit")
+                self.models[key] = cached
+                return cached[1]
+            CACHE_REQUESTS.inc(cache="geometry", result="miss")
+            model = GeometryModel(bin_path, index_path)
+            self.models[key] = (version, model)
+            # Dicts keep insertion order, the first entry is the least recently used
+            while len(self.models) > self.max_models:
+                del self.models[next(iter(self.models))]
+            return model
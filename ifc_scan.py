@@ -0,0 +1,153 @@
+import logging
+import re
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+# The header is small, stop looking for its end after this many bytes
+MAX_HEADER_SIZE = 1024 * 1024
+
+STEP_MAGIC = b"ISO-10303-21"
+# An instance header and its arguments up to the closing ";", so instances quoted in strings are not counted
+ENTITY_PATTERN = re.compile(rb"#\d+\s*=\s*([A-Za-z0-9_]+)\s*\([^';]*(?:'[^']*'[^';]*)*")
+HEADER_ENTITY_PATTERN = re.compile(r"(FILE_DESCRIPTION|FILE_NAME|FILE_SCHEMA)\s*\(", re.IGNORECASE)
+
+# Attribute names of the header entities, as in IfcConvert's XML header block
+HEADER_FIELDS = {
+    "FILE_DESCRIPTION": ("description", "implementation_level"),
+    "FILE_NAME": ("name", "time_stamp", "author", "organization", "preprocessor_version",
+                  "originating_system", "authorization"),
+    "FILE_SCHEMA": ("schema_identifiers",),
+}
+
+
+class IFCScanError(Exception):
+    pass
+
+
+def _parse_arguments(text, position):
+    """
+    Parse a parenthesised STEP argument list starting at text[position] == "(".
+    Returns the values as nested lists and the position after the closing bracket.
+    """
+    values = []
+    position += 1
+    while position < len(text):
+        char = text[position]
+        if char == "'":
+            # Strings escape a quote by doubling it
+            end = position + 1
+            parts = []
+            while True:
+                quote = text.find("'", end)
+                if quote < 0:
+                    raise IFCScanError("Unterminated string in header")
+                parts.append(text[end:quote])
+                if text.startswith("'", quote + 1):
+                    parts.append("'")
+                    end = quote + 2
+                else:
+                    break
+            values.append("".join(parts))
+            position = quote + 1
+        elif char == "(":
+            nested, position = _parse_arguments(text, position)
+            values.append(nested)
+        elif char == ")":
+            return values, position + 1
+        elif char == "$":
+            values.append(None)
+            position += 1
+        elif char in ", \t\r\n":
+            position += 1
+        else:
+            end = position
+            while end < len(text) and text[end] not in ",)":
+                end += 1
+            values.append(text[position:end].strip())
+            position = end
+    raise IFCScanError("Unterminated argument list in header")
+
+
+def _chunk_end(buffer):
+    """
+    Position after the last ";" of a buffer that is not inside a string literal.
+    The buffer must start outside one.
+    """
+    cut = buffer.rfind(b";") + 1
+    # Strings escape a quote by doubling it, so an odd number of quotes before the cut means it is inside one
+    while cut and buffer.count(b"'", 0, cut) % 2:
+        cut = buffer.rfind(b";", 0, buffer.rfind(b"'", 0, cut)) + 1
+    return cut
+
+
+def parse_header(text):
+    """
+    Read FILE_DESCRIPTION, FILE_NAME and FILE_SCHEMA from the text of a HEADER section
+    """
+    header = {}
+    for match in HEADER_ENTITY_PATTERN.finditer(text):
+        entity = match.group(1).upper()
+        arguments, _ = _parse_arguments(text, match.end() - 1)
+        header[entity.lower()] = dict(zip(HEADER_FIELDS[entity], arguments))
+    return header
+
+
+def scan_stream(stream, chunk_size=CHUNK_SIZE):
+    """
+    Read the STEP header and count entity instances by type in a single pass
+    over a binary stream, without building the model.
+    """
+    start = time.perf_counter()
+    buffer = stream.read(chunk_size)
+    if not buffer.lstrip().startswith(STEP_MAGIC):
+        raise IFCScanError("Not an ISO-10303-21 (STEP) file")
+
+    # Collect the HEADER section
+    while b"ENDSEC;" not in buffer and len(buffer) < MAX_HEADER_SIZE:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+    header_end = buffer.find(b"ENDSEC;")
+    if header_end < 0:
+        raise IFCScanError("HEADER section not found")
+    header = parse_header(buffer[:header_end].decode("utf-8", errors="replace"))
+    if "file_schema" not in header:
+        raise IFCScanError("FILE_SCHEMA missing from header")
+
+    counts = Counter()
+    size = len(buffer)
+    buffer = buffer[header_end:]
+    while True:
+        chunk = stream.read(chunk_size)
+        size += len(chunk)
+        buffer += chunk
+        # Instances end with the first ";" outside a string, splitting after the last one never cuts a match
+        cut = len(buffer) if not chunk else _chunk_end(buffer)
+        counts.update(ENTITY_PATTERN.findall(buffer, 0, cut))
+        buffer = buffer[cut:]
+        if not chunk:
+            break
+
+    entity_types = {name.decode().upper(): count for name, count in counts.most_common()}
+    file_name = header.get("file_name", {})
+    schemas = header["file_schema"].get("schema_identifiers") or []
+    return {
+        "schema": schemas[0] if schemas else None,
+        "originating_system": file_name.get("originating_system"),
+        "preprocessor_version": file_name.get("preprocessor_version"),
+        "time_stamp": file_name.get("time_stamp"),
+        "header": header,
+        "size_bytes": size,
+        "entity_count": sum(entity_types.values()),
+        "entity_types": entity_types,
+        "scan_seconds": round(time.perf_counter() - start, 4),
+    }
+
+
+def scan_file(path, chunk_size=CHUNK_SIZE):
+    with open(path, "rb") as f:
+        return scan_stream(f, chunk_size)
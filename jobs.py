@@ -0,0 +1,299 @@
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update
+
+from database import Session
+from metrics import CONVERSION_QUEUE_WAIT, CONVERSIONS
+from models import ConversionJobModel
+
+logger = logging.getLogger(__name__)
+
+# Number of conversions each worker process runs at the same time
+MAX_CONCURRENT_CONVERSIONS = int(os.environ.get("MAX_CONCURRENT_CONVERSIONS", 2))
+# Default per-job timeout in seconds, 0 disables it
+DEFAULT_CONVERSION_TIMEOUT = float(os.environ.get("CONVERSION_TIMEOUT", 3600))
+# How often idle runners look for queued jobs and running jobs report progress (seconds)
+POLL_INTERVAL = 1.0
+# A running job whose worker has not reported for this long is considered lost
+STALE_AFTER = timedelta(seconds=60)
+
+
+class JobManager:
+    def __init__(self, max_workers=MAX_CONCURRENT_CONVERSIONS):
+        """
+        Run conversions from the shared job table. Any worker process can queue,
+        inspect or cancel a job; runner threads in every process claim queued jobs.
+        """
+        self.max_workers = max_workers
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        # Jobs running in this process: id -> {"cancel_event", "progress"}
+        self.running = {}
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        for index in range(self.max_workers):
+            thread = threading.Thread(target=self._runner, name=f"conversion-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        monitor = threading.Thread(target=self._monitor, name="conversion-monitor", daemon=True)
+        monitor.start()
+        self.threads.append(monitor)
+
+    def submit(self, filename, input_dir, output_dir, timeout=DEFAULT_CONVERSION_TIMEOUT, priority=0, user=None,
+               project=None, size_bytes=None, prefer_small=False):
+        job = ConversionJobModel(
+            id=uuid.uuid4().hex, filename=filename, input_dir=input_dir, output_dir=output_dir,
+            timeout=timeout or None, priority=priority, user=user, project=project, size_bytes=size_bytes,
+            prefer_small=prefer_small, status="queued", progress=0.0, version=0, created_at=datetime.now()
+        )
+        with Session() as session:
+            session.add(job)
+            session.commit()
+        self.wakeup.set()
+        logger.info(f"Queued conversion job {job.id} for {filename}")
+        return job
+
+    def get(self, job_id):
+        with Session() as session:
+            return session.get(ConversionJobModel, job_id)
+
+    def counts(self):
+        """
+        Number of unfinished jobs by status across all workers, used for the queue depth metric
+        """
+        counts = {"queued": 0, "running": 0}
+        with Session() as session:
+            rows = session.execute(
+                select(ConversionJobModel.status, func.count())
+                .where(ConversionJobModel.status.in_(list(counts)))
+                .group_by(ConversionJobModel.status)
+            )
+            counts.update({status: count for status, count in rows})
+        return counts
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job. Returns False if the job already finished.
+        """
+        with Session() as session:
+            # A job still waiting in the queue never reaches the converter
+            queued = session.execute(
+                update(ConversionJobModel)
+                .where(ConversionJobModel.id == job_id, ConversionJobModel.status == "queued")
+                .values(status="cancelled", finished_at=datetime.now(), cancel_requested=True,
+                        result={"status": "cancelled", "message": "Conversion cancelled"},
+                        version=ConversionJobModel.version + 1)
+            ).rowcount
+            # The worker running the job notices the flag on its next report
+            running = queued or session.execute(
+                update(ConversionJobModel)
+                .where(ConversionJobModel.id == job_id, ConversionJobModel.status == "running")
+                .values(cancel_requested=True, version=ConversionJobModel.version + 1)
+            ).rowcount
+            session.commit()
+        if queued:
+            CONVERSIONS.inc(status="cancelled")
+        if running:
+            self._cancel_local(job_id)
+            logger.info(f"Cancellation requested for job {job_id}")
+        return bool(running)
+
+    def shutdown(self):
+        self.stopping.set()
+        self.wakeup.set()
+        with self.lock:
+            for state in self.running.values():
+                state["cancel_event"].set()
+
+    def _next_job(self, session):
+        """
+        Pick the queued job to run next. Only jobs of the highest queued priority
+        are considered. Among them the project, then the user, with the fewest
+        running jobs goes first, ties going to whoever was served least recently,
+        so one busy submitter cannot hold up everyone else. Within a user's queue
+        jobs asking for it run smallest file first, the rest in submission order.
+        """
+        top_priority = (
+            select(func.max(ConversionJobModel.priority))
+            .where(ConversionJobModel.status == "queued")
+            .scalar_subquery()
+        )
+        queued = session.execute(
+            select(ConversionJobModel.id, ConversionJobModel.user, ConversionJobModel.project,
+                   ConversionJobModel.size_bytes, ConversionJobModel.prefer_small, ConversionJobModel.created_at)
+            .where(ConversionJobModel.status == "queued", ConversionJobModel.priority == top_priority)
+        ).all()
+        if not queued:
+            return None
+
+        # Running jobs across all workers, per (project, user) and per project
+        running = {
+            (project, user): count for project, user, count in session.execute(
+                select(ConversionJobModel.project, ConversionJobModel.user, func.count())
+                .where(ConversionJobModel.status == "running")
+                .group_by(ConversionJobModel.project, ConversionJobModel.user)
+            )
+        }
+        running_projects = {}
+        for (project, _), count in running.items():
+            running_projects[project] = running_projects.get(project, 0) + count
+        # When each queue last had a job started, queues never served go first
+        served = {
+            (project, user): started for project, user, started in session.execute(
+                select(ConversionJobModel.project, ConversionJobModel.user, func.max(ConversionJobModel.started_at))
+                .where(ConversionJobModel.started_at.is_not(None))
+                .group_by(ConversionJobModel.project, ConversionJobModel.user)
+            )
+        }
+        served_projects = {}
+        for (project, _), started in served.items():
+            served_projects[project] = max(started, served_projects.get(project, started))
+
+        queues = {}
+        for job in queued:
+            queues.setdefault((job.project, job.user), []).append(job)
+        project, user = min(queues, key=lambda queue: (
+            running_projects.get(queue[0], 0), served_projects.get(queue[0], datetime.min),
+            running.get(queue, 0), served.get(queue, datetime.min),
+            min(job.created_at for job in queues[queue])))
+
+        def order(job):
+            if not job.prefer_small:
+                return True, 0, job.created_at
+            # Files of unknown size go after every known size
+            return False, job.size_bytes if job.size_bytes is not None else float("inf"), job.created_at
+
+        return min(queues[project, user], key=order).id
+
+    def _claim(self):
+        """
+        Atomically move the next queued job to running for this worker
+        """
+        with Session() as session:
+            while True:
+                job_id = self._next_job(session)
+                if job_id is None:
+                    return None
+                now = datetime.now()
+                claimed = session.execute(
+                    update(ConversionJobModel)
+                    .where(ConversionJobModel.id == job_id, ConversionJobModel.status == "queued")
+                    .values(status="running", worker_id=self.worker_id, started_at=now, heartbeat_at=now,
+                            version=ConversionJobModel.version + 1)
+                ).rowcount
+                session.commit()
+                # Another worker may have claimed it first, try the next one
+                if claimed:
+                    job = session.get(ConversionJobModel, job_id, populate_existing=True)
+                    CONVERSION_QUEUE_WAIT.observe(job.wait_seconds)
+                    return job
+
+    def _runner(self):
+        while not self.stopping.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                logger.error(f"Could not claim conversion job: {str(e)}")
+                job = None
+            if job is None:
+                self.wakeup.wait(POLL_INTERVAL)
+                self.wakeup.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        # "reported" is the progress last written by the monitor
+        state = {"cancel_event": threading.Event(), "progress": {}, "reported": {}}
+        with self.lock:
+            self.running[job.id] = state
+
+        def on_progress(phase, progress, elements):
+            # Written to the database by the monitor thread, at most once per POLL_INTERVAL
+            state["progress"].update(phase=phase, progress=progress)
+            if elements is not None:
+                state["progress"]["elements_processed"] = elements
+
+        try:
+            # Loaded with the first conversion, not when the app starts
+            from converter import IFCConverter
+
+            converter = IFCConverter(input_dir=job.input_dir, output_dir=job.output_dir)
+            result = converter.convert_file(job.filename, timeout=job.timeout,
+                                            cancel_event=state["cancel_event"], progress_callback=on_progress)
+        except Exception as e:
+            logger.error(f"Conversion job {job.id} crashed: {str(e)}")
+            result = {"status": "failure", "message": str(e)}
+        finally:
+            with self.lock:
+                del self.running[job.id]
+
+        with Session() as session:
+            session.execute(
+                update(ConversionJobModel)
+                .where(ConversionJobModel.id == job.id)
+                .values(status=result["status"], result=result, finished_at=datetime.now(),
+                        version=ConversionJobModel.version + 1, **state["progress"])
+            )
+            session.commit()
+        CONVERSIONS.inc(status=result["status"])
+        logger.info(f"Conversion job {job.id} finished with status {result['status']}")
+
+    def _cancel_local(self, job_id):
+        with self.lock:
+            state = self.running.get(job_id)
+        if state is not None:
+            state["cancel_event"].set()
+
+    def _monitor(self):
+        """
+        Report progress and heartbeats of local jobs, pick up cancellations
+        requested through other workers and fail jobs whose worker died.
+        """
+        while not self.stopping.wait(POLL_INTERVAL):
+            try:
+                with self.lock:
+                    running = {job_id: (dict(state["progress"]), state["reported"])
+                               for job_id, state in self.running.items()}
+                with Session() as session:
+                    now = datetime.now()
+                    changed = {}
+                    for job_id, (progress, reported) in running.items():
+                        # The version only moves with the progress, so event streams send nothing new otherwise
+                        values = {"heartbeat_at": now}
+                        if progress != reported:
+                            values.update(version=ConversionJobModel.version + 1, **progress)
+                            changed[job_id] = progress
+                        session.execute(
+                            update(ConversionJobModel)
+                            .where(ConversionJobModel.id == job_id, ConversionJobModel.status == "running")
+                            .values(**values)
+                        )
+                    if running:
+                        cancelled = session.scalars(
+                            select(ConversionJobModel.id)
+                            .where(ConversionJobModel.id.in_(list(running)), ConversionJobModel.cancel_requested)
+                        ).all()
+                        for job_id in cancelled:
+                            self._cancel_local(job_id)
+                    session.execute(
+                        update(ConversionJobModel)
+                        .where(ConversionJobModel.status == "running",
+                               ConversionJobModel.heartbeat_at < now - STALE_AFTER)
+                        .values(status="failure", finished_at=now, version=ConversionJobModel.version + 1,
+                                result={"status": "failure", "message": "Worker running the conversion was lost"})
+                    )
+                    session.commit()
+                with self.lock:
+                    for job_id, progress in changed.items():
+                        if job_id in self.running:
+                            self.running[job_id]["reported"] = progress
+            except Exception as e:
+                logger.error(f"Conversion monitor failed: {str(e)}")
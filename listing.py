@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+from starlette.concurrency import run_in_threadpool
+
+import database
+from coordination import FileLock
+from metrics import CACHE_REQUESTS
+
+# Shared state holding the listing version and the latest changes
+LISTING_STATE_KEY = "listing"
+# Changes kept in the shared log, workers further behind rebuild the whole listing
+MAX_CHANGES = int(os.environ.get("LISTING_MAX_CHANGES", 100))
+# Rebuild from storage at least this often (seconds) to pick up files changed
+# outside the API, 0 disables
+LISTING_MAX_AGE = float(os.environ.get("LISTING_MAX_AGE", 300))
+
+
+def _encode(value):
+    # Same output as FastAPI's JSONResponse
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+
+def read_state():
+    return database.get_state(LISTING_STATE_KEY) or {"version": 0, "changes": []}
+
+
+def record_change(folder, action):
+    """
+    Bump the shared listing version and log which folder changed. Returns the new version.
+    """
+    lock = FileLock("listing-state")
+    lock.acquire()
+    try:
+        state = read_state()
+        version = state["version"] + 1
+        change = {"version": version, "folder": folder, "action": action, "at": datetime.now().isoformat()}
+        database.set_state(LISTING_STATE_KEY, {
+            "version": version,
+            "changes": (state["changes"] + [change])[-MAX_CHANGES:],
+        })
+        return version
+    finally:
+        lock.release()
+
+
+def changes_since(state, version):
+    """
+    Changes in a shared state after version, None if they are no longer all in the log
+    """
+    changes = [change for change in state["changes"] if change["version"] > version]
+    if len(changes) != state["version"] - version:
+        return None
+    return changes
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+class ListingCache:
+    def __init__(self, storage):
+        """
+        The /list response, kept serialised between requests. Uploads and deletes
+        log the folder they changed in the shared state; each worker re-lists only
+        those folders when it sees a newer version, and everything when it has
+        fallen too far behind.
+        """
+        self.storage = storage
+        # folder name -> serialised entry
+        self.folders = {}
+        self.version = None
+        self.built_at = 0.0
+        self.body = None
+        self.etag = None
+        self.lock = asyncio.Lock()
+
+    def _expired(self):
+        return LISTING_MAX_AGE and time.monotonic() - self.built_at > LISTING_MAX_AGE
+
+    async def get(self):
+        """
+        Return the serialised listing, its ETag and its version
+        """
+        state = await run_in_threadpool(read_state)
+        async with self.lock:
+            if self.body is not None and self.version == state["version"] and not self._expired():
+                CACHE_REQUESTS.inc(cache="listing", result="hit")
+                return self.body, self.etag, self.version
+            CACHE_REQUESTS.inc(cache="listing", result="miss")
+
+            changes = None if self.body is None or self._expired() else changes_since(state, self.version)
+            if changes is None:
+                self.folders = {entry["folder_name"]: _encode(entry) for entry in await self.storage.list_folders()}
+                self.built_at = time.monotonic()
+            else:
+                for folder in dict.fromkeys(change["folder"] for change in changes):
+                    entry = await self.storage.list_folder(folder)
+                    if entry is None:
+                        self.folders.pop(folder, None)
+                    else:
+                        self.folders[folder] = _encode(entry)
+
+            # The envelope is written by hand so unchanged entries are not encoded again. Entries are
+            # sorted by name so every worker serves the same body and ETag for the same version.
+            entries = b",".join(self.folders[folder] for folder in sorted(self.folders))
+            self.body = b'{"total_folders":%d,"folders":[%s]}' % (len(self.folders), entries)
+            self.etag = f'"{hashlib.blake2b(self.body, digest_size=12).hexdigest()}"'
+            self.version = state["version"]
+            return self.body, self.etag, self.version
@@ -1,13 +1,25 @@
-import shutil
-import subprocess
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request, Body, Query
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 import os
-from datetime import datetime
 import logging
 import asyncio
-from converter import IFCConverter
+import functools
+import json
+import math
+import re
+import time
+from typing import Optional
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+import catalog
+import database
+import listing
+import metrics
+from coordination import LeaderElection, folder_lock
+from ifc_scan import IFCScanError, scan_stream
+from storage import create_storage
+from jobs import JobManager, DEFAULT_CONVERSION_TIMEOUT
 from sensor_data import sensordata, update_data
 
 # Configure logging
@@ -17,13 +29,27 @@ logging.basicConfig(
     filename='unused/ifc_upload.log'
 )
 logger = logging.getLogger(__name__)
+
+# Only one worker process produces sensor data, the others read it from the shared state
+sensor_election = LeaderElection("sensor-producer")
+SENSOR_STATE_KEY = "sensordata"
+
+
+async def publish_sensordata(data):
+    await run_in_threadpool(database.set_state, SENSOR_STATE_KEY, data)
+
+
 # Define the lifespan event
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup logic
-    task = asyncio.create_task(update_data())
+    await run_in_threadpool(database.create_tables)
+    job_manager.start()
+    task = asyncio.create_task(sensor_election.run(lambda: update_data(publish_sensordata)))
     yield  # The app runs during this yield
     # Shutdown logic
+    job_manager.shutdown()
+    storage.shutdown()
     task.cancel()
     try:
         await task
@@ -37,19 +63,76 @@ app = FastAPI(
 )
 
 # Configuration
-UPLOAD_DIR = "uploads"
-CONVERTED_DIR = "converted"
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "uploads")
+CONVERTED_DIR = os.environ.get("CONVERTED_DIR", "converted")
 
 ALLOWED_EXTENSIONS = {'.ifc'}
 ALLOWED_IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+# Reject uploads with more entity instances than this, 0 disables the limit
+MAX_IFC_ENTITIES = int(os.environ.get("MAX_IFC_ENTITIES", 0))
+
+# Where uploads are kept, local disk unless STORAGE_BACKEND selects S3
+storage = create_storage(UPLOAD_DIR)
+
+# Background conversions
+job_manager = JobManager()
+
+# Serialised /list response, updated as folders are uploaded and deleted
+listing_cache = listing.ListingCache(storage)
+# How often change feeds look for a new listing version (seconds)
+LISTING_POLL_INTERVAL = 1.0
+
+
+@functools.cache
+def geometry_cache():
+    """
+    Memory-mapped per-element geometry of converted models. Created on first
+    use, so NumPy is not loaded until a geometry endpoint is called.
+    """
+    from geometry_index import GeometryCache
+
+    return GeometryCache()
 
-# Create necessary directories
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# IFC GlobalIds are 22 characters of a base64 alphabet
+GLOBAL_ID_PATTERN = re.compile(r"[0-9A-Za-z_$]{22}")
+
+# Most elements a nearest or pick query may return
+MAX_SPATIAL_RESULTS = 1000
+
+metrics.Gauge(
+    "conversion_queue_depth", "Conversion jobs waiting or running", ("status",),
+    callback=lambda: {(status,): count for status, count in job_manager.counts().items()}
+)
+
+
+@app.middleware("http")
+async def record_request_timing(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Use the route template so /download/a and /download/b share a series
+        route = request.scope.get("route")
+        metrics.record_span(
+            "http.request", time.perf_counter() - start, metrics.REQUEST_DURATION,
+            method=request.method, route=route.path if route else "unmatched", status=status
+        )
+
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render_latest(), media_type="text/plain; version=0.0.4")
 
 # Endpoint to fetch the data
 @app.get("/sensordata")
 def get_sensordata():
-    return sensordata
+    if sensor_election.is_leader:
+        return sensordata
+    return database.get_state(SENSOR_STATE_KEY, sensordata)
 
 
 @app.post("/upload/")
@@ -60,24 +143,34 @@ async def upload(ifc_file: UploadFile = File(...), img_file: UploadFile = File(.
     if not img_file.filename.endswith(tuple(ALLOWED_IMAGE_EXTENSIONS)):
         return JSONResponse(status_code=400, content={"message": "Only image files (.png, .jpg, .jpeg) are allowed"})
 
-    # Create a subdirectory for this upload
-    sub_dir = os.path.join(UPLOAD_DIR, os.path.splitext(ifc_file.filename)[0])
-    os.makedirs(sub_dir, exist_ok=True)
-
-    # Save IFC file
-    ifc_path = os.path.join(sub_dir, ifc_file.filename)
-    with open(ifc_path, "wb") as f:
-        f.write(await ifc_file.read())
-
-    # Save Image file
-    img_path = os.path.join(sub_dir, img_file.filename)
-    with open(img_path, "wb") as f:
-        f.write(await img_file.read())
+    # Pre-scan the header and entity counts before anything is stored
+    try:
+        with metrics.span("upload.scan", filename=ifc_file.filename):
+            scan = await run_in_threadpool(scan_stream, ifc_file.file)
+    except IFCScanError as e:
+        return JSONResponse(status_code=400, content={"message": f"Invalid IFC file: {e}"})
+    if MAX_IFC_ENTITIES and scan["entity_count"] > MAX_IFC_ENTITIES:
+        return JSONResponse(status_code=413, content={
+            "message": f"IFC file has {scan['entity_count']} entities, the limit is {MAX_IFC_ENTITIES}"
+        })
+    await ifc_file.seek(0)
+
+    # Save IFC and image file in a folder named after the IFC file
+    folder = os.path.splitext(ifc_file.filename)[0]
+    ifc_key = f"{folder}/{ifc_file.filename}"
+    img_key = f"{folder}/{img_file.filename}"
+    async with folder_lock(folder):
+        metrics.UPLOAD_BYTES.inc(await storage.save(ifc_key, ifc_file.file))
+        metrics.UPLOAD_BYTES.inc(await storage.save(img_key, img_file.file))
+
+        await run_in_threadpool(catalog.record_upload, folder, ifc_file.filename, img_file.filename, scan)
+        await run_in_threadpool(listing.record_change, folder, "upload")
 
     return {
         "message": "Files uploaded successfully!",
-        "ifc_file": ifc_path,
-        "img_file": img_path
+        "ifc_file": storage.location(ifc_key),
+        "img_file": storage.location(img_key),
+        "scan": scan
     }
 
 @app.get("/download/{folder}")
@@ -85,129 +178,378 @@ async def download_folder(folder: str):
     """
     Download a stored IFC file
     """
-    folder_path = os.path.join(UPLOAD_DIR, folder)
-
-    if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
-        raise HTTPException(status_code=404, detail="Folder not found")
-    # Create a temporary zip file
-    zip_file_path = f"{folder_path}.zip"
-    shutil.make_archive(folder_path, 'zip', folder_path)
+    # Hold the folder lock so an upload or delete cannot change it while it is zipped
+    async with folder_lock(folder, shared=True):
+        if not await storage.folder_exists(folder):
+            raise HTTPException(status_code=404, detail="Folder not found")
+        # Create a temporary zip file
+        with metrics.span("download.archive", folder=folder):
+            zip_file_path, temporary = await storage.archive_folder(folder)
 
     # Ensure the file exists before returning it
     if not os.path.exists(zip_file_path):
         raise HTTPException(status_code=500, detail="Could not create zip file")
+    metrics.DOWNLOAD_BYTES.inc(os.path.getsize(zip_file_path))
 
     # Return the zip file as a response
     return FileResponse(
         zip_file_path,
         media_type="application/zip",
         filename=f"{folder}.zip",
+        background=BackgroundTask(os.remove, zip_file_path) if temporary else None,
     )
 
 
 @app.get("/list")
-async def list_uploaded_files():
+async def list_uploaded_files(request: Request):
     """
-    List all uploaded folders and their contents
+    List all uploaded folders and their contents. Answers 304 Not Modified
+    when If-None-Match holds the ETag of the current listing.
     """
     try:
-        # Ensure the upload directory exists
-        if not os.path.exists(UPLOAD_DIR):
-            return {"folders": []}
-
-        # List all subdirectories in the upload directory
-        folders = [
-            {
-                "folder_name": folder,
-                "files": os.listdir(os.path.join(UPLOAD_DIR, folder)),
-                "uploaded_at": datetime.fromtimestamp(
-                    os.path.getctime(os.path.join(UPLOAD_DIR, folder))
-                ).isoformat()
-            }
-            for folder in os.listdir(UPLOAD_DIR)
-            if os.path.isdir(os.path.join(UPLOAD_DIR, folder))
-        ]
-
-        return {
-            "total_folders": len(folders),
-            "folders": folders
-        }
+        body, etag, version = await listing_cache.get()
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error listing files: {str(e)}"
         )
 
+    headers = {"ETag": etag, "X-Listing-Version": str(version), "Cache-Control": "no-cache"}
+    if listing.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@app.get("/list/events")
+async def list_events(request: Request):
+    """
+    Stream changes to the listing as server-sent events. Every event carries the
+    listing version and the folders uploaded or deleted since the previous one;
+    changes is null when they are no longer known and the client should fetch
+    /list again. Reconnecting clients resume from Last-Event-ID.
+    """
+    last_event_id = request.headers.get("last-event-id", "")
+    version = int(last_event_id) if last_event_id.isdigit() else None
+
+    async def event_stream():
+        nonlocal version
+        while not await request.is_disconnected():
+            # Uploads may go through other workers, so re-read the shared state
+            state = await run_in_threadpool(listing.read_state)
+            if state["version"] != version:
+                # New clients are first told where the feed starts
+                changes = [] if version is None else listing.changes_since(state, version)
+                version = state["version"]
+                yield f"id: {version}\ndata: {json.dumps({'version': version, 'changes': changes})}\n\n"
+            await asyncio.sleep(LISTING_POLL_INTERVAL)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.delete("/delete/{folder}")
 async def delete_folder(folder: str):
     """
     Delete a stored folder and its contents
     """
-    folder_path = os.path.join(UPLOAD_DIR, folder)
-    zip_file_path = f"{folder_path}.zip"
-
-    # Check if folder exists
-    if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
-        raise HTTPException(status_code=404, detail="Folder not found")
+    async with folder_lock(folder):
+        # Check if folder exists
+        if not await storage.folder_exists(folder):
+            raise HTTPException(status_code=404, detail="Folder not found")
 
-    try:
-        # Remove the folder and its contents
-        shutil.rmtree(folder_path)
+        try:
+            # Remove the folder, its contents and the zip file if it exists
+            await storage.delete_folder(folder)
 
-        # Remove the zip file if it exists
-        if os.path.exists(zip_file_path):
-            os.remove(zip_file_path)
+            await run_in_threadpool(catalog.delete_upload, folder)
+            await run_in_threadpool(listing.record_change, folder, "delete")
+        except Exception as e:
+            logger.error(f"Error deleting folder: {e}")
+            raise HTTPException(status_code=500, detail="Could not delete folder")
 
-        return {
-            "message": f"Folder {folder} and associated files deleted successfully",
-            "deleted_folder": folder
-        }
-    except Exception as e:
-        # Log the error (you might want to use a proper logging mechanism)
-        print(f"Error deleting folder: {e}")
-        raise HTTPException(status_code=500, detail="Could not delete folder")
+    return {
+        "message": f"Folder {folder} and associated files deleted successfully",
+        "deleted_folder": folder
+    }
 
 
-@app.post("/convert/")
+@app.post("/convert/", status_code=202)
 async def convert_file(
         filename: str = Form(...),
-        destination_dir: str = Form("converted")
+        destination_dir: str = Form("converted"),
+        timeout: float = Form(DEFAULT_CONVERSION_TIMEOUT),
+        priority: int = Form(0),
+        user: Optional[str] = Form(None),
+        project: Optional[str] = Form(None),
+        prefer_small: bool = Form(False)
 ):
     """
-    Convert an IFC file to OBJ and XML formats
+    Start converting an IFC file to OBJ and XML formats in the background
 
     :param filename: Name of the IFC file to convert
     :param destination_dir: Optional destination directory for converted files
+    :param timeout: Seconds after which the conversion is aborted, 0 disables the limit
+    :param priority: Jobs with a higher priority are started first
+    :param user: Submitting user, queued jobs are shared fairly between users
+    :param project: Project of the model, queued jobs are shared fairly between projects
+    :param prefer_small: Schedule by file size, smallest first, ahead of the user's other queued jobs
     """
+    # Validate filename exists in upload directory
+    if not await storage.exists(filename):
+        raise HTTPException(status_code=404, detail=f"File {filename} not found in uploads")
+
     try:
-        # Validate filename exists in upload directory
-        input_file_path = os.path.join(UPLOAD_DIR, filename)
-        if not os.path.exists(input_file_path):
-            raise HTTPException(status_code=404, detail=f"File {filename} not found in uploads")
-
-        # Create converter with input from upload directory
-        converter = IFCConverter(
-            input_dir=UPLOAD_DIR,
-            output_dir=os.path.join(CONVERTED_DIR, destination_dir)
+        # The converter reads from local disk
+        input_dir = await storage.materialize(filename)
+        # The size recorded at upload lets the scheduler put small files first
+        upload = await run_in_threadpool(catalog.get_upload, filename.split("/")[0])
+        job = await run_in_threadpool(
+            job_manager.submit,
+            filename,
+            input_dir=input_dir,
+            output_dir=os.path.join(CONVERTED_DIR, destination_dir),
+            timeout=timeout,
+            priority=priority,
+            user=user,
+            project=project,
+            size_bytes=upload["size_bytes"] if upload else None,
+            prefer_small=prefer_small
         )
-
-        # Perform the conversion
-        result = converter.convert_file(filename)
-
-        # Check conversion status
-        if result['status'] == 'success':
-            return {
-                "message": "Conversion successful",
-                "obj_path": result['obj_path'],
-                "xml_path": result['xml_path']
-            }
-        else:
-            raise HTTPException(status_code=500, detail=result['message'])
-
     except Exception as e:
         logger.error(f"Conversion error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    return {
+        "message": "Conversion started",
+        "job_id": job.id,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events"
+    }
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Get the status and progress of a conversion job
+    """
+    job = await run_in_threadpool(job_manager.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Stream progress updates of a conversion job as server-sent events until it finishes
+    """
+    job = await run_in_threadpool(job_manager.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        nonlocal job
+        version = None
+        while True:
+            # The job may be running in another worker, so re-read the shared job table
+            job = await run_in_threadpool(job_manager.get, job_id)
+            if job.version != version:
+                version = job.version
+                yield f"data: {json.dumps(job.to_dict())}\n\n"
+            if job.finished:
+                break
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    Cancel a queued or running conversion job
+    """
+    job = await run_in_threadpool(job_manager.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not await run_in_threadpool(job_manager.cancel, job_id):
+        raise HTTPException(status_code=409, detail=f"Job already finished with status {job.status}")
+    return {"message": "Cancellation requested", "job_id": job_id}
+
+
+async def load_geometry(model, destination_dir):
+    from geometry_index import geometry_paths
+
+    bin_path, index_path = geometry_paths(os.path.join(CONVERTED_DIR, destination_dir), model)
+    geometry = await run_in_threadpool(geometry_cache().get, bin_path, index_path)
+    if geometry is None:
+        raise HTTPException(status_code=404, detail=f"No geometry index for {model}, convert it first")
+    return geometry
+
+
+@app.get("/geometry/{model:path}/index")
+async def get_geometry_index(model: str, destination_dir: str = "converted"):
+    """
+    List the elements of a converted model with their bounding boxes and triangle counts
+
+    :param model: Converted file name without extension, e.g. folder/model
+    """
+    geometry = await load_geometry(model, destination_dir)
+    index = geometry.index
+    return {
+        "total_elements": len(index),
+        "elements": [
+            {"global_id": guid.decode(), "triangles": triangles, "bbox": bbox}
+            for guid, triangles, bbox in zip(index["guid"].tolist(), index["triangles"].tolist(),
+                                             index["bbox"].tolist())
+        ]
+    }
+
+
+@app.post("/geometry/{model:path}")
+async def get_element_geometry(
+        model: str,
+        global_ids: list[str] = Body(..., embed=True),
+        destination_dir: str = "converted"
+):
+    """
+    Fetch the meshes of single elements of a converted model by GlobalId.
+
+    The response is a uint32 element count followed by one record per found element:
+    22 byte GlobalId, 2 bytes padding, uint32 vertex count, uint32 triangle count,
+    float32 xyz vertices and uint32 triangle indices, all little-endian.
+    GlobalIds without geometry are listed in the X-Missing-Global-Ids header,
+    ids that are not 22 character GlobalIds are rejected.
+    """
+    invalid = [global_id for global_id in global_ids if not GLOBAL_ID_PATTERN.fullmatch(global_id)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid GlobalIds: {', '.join(invalid[:10])}")
+    geometry = await load_geometry(model, destination_dir)
+    rows, missing = await run_in_threadpool(geometry.lookup, global_ids)
+    size = 4 + int(rows["length"].sum())
+    metrics.GEOMETRY_BYTES.inc(size)
+
+    def records():
+        yield len(rows).to_bytes(4, "little")
+        # Slices of the mapped file, only the requested records are read from disk
+        yield from geometry.records(rows)
+
+    headers = {"Content-Length": str(size), "X-Missing-Global-Ids": ",".join(missing)}
+    return StreamingResponse(records(), media_type="application/octet-stream", headers=headers)
+
+
+def parse_point(value, name):
+    """
+    Parse a query parameter given as x,y,z
+    """
+    try:
+        point = [float(coordinate) for coordinate in value.split(",")]
+    except ValueError:
+        point = []
+    # float() also accepts nan and inf
+    if len(point) != 3 or not all(map(math.isfinite, point)):
+        raise HTTPException(status_code=400, detail=f"{name} must be three comma separated finite numbers")
+    return point
+
+
+async def load_bvh(model, destination_dir):
+    geometry = await load_geometry(model, destination_dir)
+    if await run_in_threadpool(lambda: geometry.bvh) is None:
+        raise HTTPException(status_code=404, detail=f"No spatial index for {model}, convert it again")
+    return geometry
+
+
+def spatial_result(global_ids, distances, started):
+    elements = [{"global_id": guid.decode()} for guid in global_ids.tolist()]
+    if distances is not None:
+        for element, distance in zip(elements, distances.tolist()):
+            element["distance"] = distance
+    return {
+        "total_elements": len(elements),
+        "elements": elements,
+        "query_ms": (time.perf_counter() - started) * 1000
+    }
+
+
+@app.get("/geometry/{model:path}/box")
+async def query_box(
+        model: str,
+        minimum: str = Query(..., alias="min"),
+        maximum: str = Query(..., alias="max"),
+        destination_dir: str = "converted"
+):
+    """
+    Find elements whose bounding box intersects an axis-aligned box
+
+    :param min: Minimum corner as x,y,z
+    :param max: Maximum corner as x,y,z
+    """
+    minimum, maximum = parse_point(minimum, "min"), parse_point(maximum, "max")
+    geometry = await load_bvh(model, destination_dir)
+
+    def query():
+        started = time.perf_counter()
+        items = geometry.bvh.box(minimum, maximum)
+        return spatial_result(geometry.index["guid"][items["element"]], None, started)
+
+    return await run_in_threadpool(query)
+
+
+@app.get("/geometry/{model:path}/nearest")
+async def query_nearest(model: str, point: str, k: int = 1, destination_dir: str = "converted"):
+    """
+    Find the k elements whose bounding boxes are closest to a point
+
+    :param point: Query point as x,y,z
+    :param k: Number of elements to return
+    """
+    point = parse_point(point, "point")
+    if not 1 <= k <= MAX_SPATIAL_RESULTS:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {MAX_SPATIAL_RESULTS}")
+    geometry = await load_bvh(model, destination_dir)
+
+    def query():
+        started = time.perf_counter()
+        items, distances = geometry.bvh.nearest(point, k)
+        return spatial_result(geometry.index["guid"][items["element"]], distances, started)
+
+    return await run_in_threadpool(query)
+
+
+@app.get("/geometry/{model:path}/pick")
+async def query_pick(
+        model: str,
+        origin: str,
+        direction: str,
+        max_distance: Optional[float] = None,
+        limit: int = 1,
+        exact: bool = False,
+        destination_dir: str = "converted"
+):
+    """
+    Find the elements hit by a ray, closest first
+
+    :param origin: Ray origin as x,y,z
+    :param direction: Ray direction as x,y,z
+    :param max_distance: Ignore hits further away than this, unlimited by default
+    :param limit: Number of hits to return
+    :param exact: Intersect the element triangles instead of only their bounding boxes
+    """
+    origin, direction = parse_point(origin, "origin"), parse_point(direction, "direction")
+    if not any(direction):
+        raise HTTPException(status_code=400, detail="direction must not be zero")
+    if max_distance is None:
+        max_distance = float("inf")
+    elif not math.isfinite(max_distance) or max_distance < 0:
+        raise HTTPException(status_code=400, detail="max_distance must be a non-negative number")
+    if not 1 <= limit <= MAX_SPATIAL_RESULTS:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_SPATIAL_RESULTS}")
+    geometry = await load_bvh(model, destination_dir)
+
+    def query():
+        started = time.perf_counter()
+        global_ids, distances = geometry.pick(origin, direction, max_distance, limit, exact)
+        return spatial_result(global_ids, distances, started)
+
+    return await run_in_threadpool(query)
+
 if __name__ == "__main__":
     import uvicorn
 
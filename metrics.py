@@ -0,0 +1,183 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONVERSION_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+REGISTRY = []
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        A metric family in the Prometheus text exposition format
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, (), value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, key, extra, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        """
+        :param callback: Optional function returning {label values tuple: value},
+            evaluated on every scrape instead of storing values
+        """
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        if self.callback is None:
+            return super().samples()
+        return [(self.name, key, (), value) for key, value in self.callback().items() if value is not None]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", key, (("le", _format_value(bound)),), count))
+                samples.append((f"{self.name}_sum", key, (), total))
+                samples.append((f"{self.name}_count", key, (), counts[-1]))
+        return samples
+
+
+def _memory_usage():
+    usage = {}
+    # Current resident set size, Linux only
+    try:
+        with open("/proc/self/statm") as statm:
+            usage[("resident",)] = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, AttributeError, ValueError):
+        pass
+    if resource is not None:
+        # ru_maxrss is reported in kilobytes on Linux
+        usage[("peak_resident",)] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return usage
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+UPLOAD_BYTES = Counter("upload_bytes_total", "Bytes received through /upload/")
+DOWNLOAD_BYTES = Counter("download_bytes_total", "Bytes sent through /download/")
+GEOMETRY_BYTES = Counter("geometry_bytes_total", "Bytes of element meshes sent through /geometry/")
+CONVERSION_PHASE_DURATION = Histogram(
+    "conversion_phase_duration_seconds", "Time spent in each conversion phase", ("phase",),
+    buckets=CONVERSION_BUCKETS)
+CONVERSIONS = Counter("conversions_total", "Finished conversions by final status", ("status",))
+CONVERSION_QUEUE_WAIT = Histogram(
+    "conversion_queue_wait_seconds", "Time conversion jobs waited in the queue before starting",
+    buckets=CONVERSION_BUCKETS)
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by cache and result", ("cache", "result"))
+PROCESS_MEMORY = Gauge("process_memory_bytes", "Memory used by this process", ("kind",), callback=_memory_usage)
+
+
+@contextmanager
+def span(name, histogram=None, **labels):
+    """
+    Time a block of code, write a structured log line and optionally
+    record the duration in a histogram with the given labels.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start, histogram, **labels)
+
+
+def record_span(name, duration, histogram=None, **labels):
+    """
+    Log and record a span whose duration was measured elsewhere
+    """
+    if histogram is not None:
+        histogram.observe(duration, **labels)
+    fields = " ".join(f"{key}={value}" for key, value in labels.items())
+    logger.info(f"span name={name} duration_ms={duration * 1000:.1f} {fields}".rstrip())
+
+
+def render_latest():
+    """
+    Render every registered metric in the Prometheus text format
+    """
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
@@ -1,5 +1,7 @@
+from sqlalchemy import JSON, String
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 from datetime import datetime
+from typing import Optional
 
 
 class Base(DeclarativeBase):
@@ -10,6 +12,100 @@ class FileModel(Base):
     __tablename__ = "bim-app-store"
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    folder: Mapped[str] = mapped_column(unique=True, index=True)
     ifc_filename: Mapped[str]
     img_filename: Mapped[str]
-    upload_time: Mapped[datetime] = mapped_column(default=datetime.now())
\ No newline at end of file
+    upload_time: Mapped[datetime] = mapped_column(default=datetime.now)
+    # Results of the pre-scan done on upload
+    size_bytes: Mapped[Optional[int]]
+    schema: Mapped[Optional[str]]
+    originating_system: Mapped[Optional[str]]
+    entity_count: Mapped[Optional[int]]
+    entity_types: Mapped[Optional[dict]] = mapped_column(JSON)
+    header: Mapped[Optional[dict]] = mapped_column(JSON)
+
+    def to_dict(self):
+        return {
+            "folder": self.folder,
+            "ifc_filename": self.ifc_filename,
+            "img_filename": self.img_filename,
+            "upload_time": self.upload_time.isoformat() if self.upload_time else None,
+            "size_bytes": self.size_bytes,
+            "schema": self.schema,
+            "originating_system": self.originating_system,
+            "entity_count": self.entity_count,
+            "entity_types": self.entity_types,
+            "header": self.header,
+        }
+
+
+class ConversionJobModel(Base):
+    __tablename__ = "conversion_jobs"
+
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    filename: Mapped[str]
+    input_dir: Mapped[str]
+    output_dir: Mapped[str]
+    timeout: Mapped[Optional[float]]
+    # Scheduling: higher priorities run first, then users and projects share the workers
+    priority: Mapped[int] = mapped_column(default=0, index=True)
+    user: Mapped[Optional[str]]
+    project: Mapped[Optional[str]]
+    # Size of the uploaded IFC file, used to run small files first when prefer_small is set
+    size_bytes: Mapped[Optional[int]]
+    prefer_small: Mapped[bool] = mapped_column(default=False)
+    status: Mapped[str] = mapped_column(default="queued", index=True)
+    phase: Mapped[Optional[str]]
+    progress: Mapped[float] = mapped_column(default=0.0)
+    elements_processed: Mapped[Optional[int]]
+    result: Mapped[Optional[dict]] = mapped_column(JSON)
+    # Set by any worker, picked up by the worker running the job
+    cancel_requested: Mapped[bool] = mapped_column(default=False)
+    worker_id: Mapped[Optional[str]]
+    # Incremented on every change so listeners can tell when to push an update
+    version: Mapped[int] = mapped_column(default=0)
+    created_at: Mapped[datetime] = mapped_column(default=datetime.now, index=True)
+    started_at: Mapped[Optional[datetime]]
+    finished_at: Mapped[Optional[datetime]]
+    heartbeat_at: Mapped[Optional[datetime]]
+
+    @property
+    def finished(self):
+        return self.status in ("success", "failure", "cancelled", "timeout")
+
+    @property
+    def wait_seconds(self):
+        """
+        Time spent queued, so far for jobs that have not started yet
+        """
+        end = self.started_at or self.finished_at or datetime.now()
+        return max((end - self.created_at).total_seconds(), 0.0)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "phase": self.phase,
+            "progress": round(self.progress, 4),
+            "elements_processed": self.elements_processed,
+            "timeout": self.timeout,
+            "priority": self.priority,
+            "user": self.user,
+            "project": self.project,
+            "size_bytes": self.size_bytes,
+            "prefer_small": self.prefer_small,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "result": self.result,
+        }
+
+
+class StateModel(Base):
+    __tablename__ = "shared_state"
+
+    key: Mapped[str] = mapped_column(primary_key=True)
+    value: Mapped[Optional[dict]] = mapped_column(JSON)
+    updated_at: Mapped[datetime] = mapped_column(default=datetime.now)
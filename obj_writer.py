@@ -0,0 +1,210 @@
+import gzip
+import io
+
+import numpy as np
+
+# Rows collected before they are formatted together, bounds a batch to a few MB
+CHUNK_ROWS = 65536
+# Size of the write buffer in front of the file
+BUFFER_SIZE = 1 << 20
+# Decimals written for coordinates and normals, a micrometre for models in metres
+DEFAULT_PRECISION = 6
+# Fast compression keeps most of the size reduction of numeric text
+GZIP_LEVEL = 1
+# Largest magnitude the fixed-point digits are computed for without overflowing int64
+MAX_SCALED = 1 << 62
+
+MINUS, DOT, ZERO = ord("-"), ord("."), ord("0")
+# Characters of every three digit group, one column per group value
+DIGIT_GROUPS = np.array([list(f"{group:03d}".encode()) for group in range(1000)], dtype=np.uint8).T.copy()
+
+
+def _digits(values, decimals):
+    """
+    Decimal characters of a 1D array of numbers, computed three digits at a
+    time with array operations. Returns a (width, len(values)) uint8 array
+    holding one character position per row. Leading zeros, trailing fraction
+    zeros and the sign of non-negative numbers are set to NUL for removal.
+    """
+    magnitude = np.abs(values)
+    if decimals:
+        if not np.isfinite(values).all():
+            raise ValueError("Cannot write NaN or infinite coordinates")
+        if magnitude.size and magnitude.max() * 10 ** decimals >= MAX_SCALED:
+            raise ValueError(f"Coordinates too large for {decimals} decimals")
+        magnitude = np.rint(magnitude * 10 ** decimals).astype(np.int64)
+
+    int_width = max(len(str(int(magnitude.max()))) - decimals, 1) if magnitude.size else 1
+    digit_count = int_width + decimals
+    # Whole groups of three, the surplus leading zeros are cut off below
+    padded = np.empty((-(-digit_count // 3) * 3, len(values)), dtype=np.uint8)
+    remaining = magnitude
+    largest = int(magnitude.max()) if magnitude.size else 0
+    for end in range(len(padded), 0, -3):
+        # 32-bit division is about twice as fast, switch as soon as the rest fits
+        if largest < 2 ** 31 and remaining.dtype != np.int32:
+            remaining = remaining.astype(np.int32)
+        quotient = remaining // 1000
+        np.take(DIGIT_GROUPS, remaining - quotient * 1000, axis=1, out=padded[end - 3:end])
+        remaining = quotient
+        largest //= 1000
+    digits = padded[len(padded) - digit_count:]
+
+    width = 1 + digit_count + (1 if decimals else 0)
+    chars = np.empty((width, len(values)), dtype=np.uint8)
+    chars[0] = MINUS * ((values < 0) & (magnitude != 0))
+    chars[1:1 + int_width] = digits[:int_width]
+    # Leading zeros go, but the last integer digit always stays
+    leading = chars[1] == ZERO
+    for position in range(1, int_width):
+        chars[position] *= ~leading
+        leading &= chars[position + 1] == ZERO
+    if decimals:
+        chars[1 + int_width] = DOT
+        chars[2 + int_width:] = digits[int_width:]
+        # Trailing zeros go, but one fraction digit always stays, like Python prints 1.0
+        trailing = chars[width - 1] == ZERO
+        for position in range(width - 1, 2 + int_width, -1):
+            chars[position] *= ~trailing
+            trailing &= chars[position - 1] == ZERO
+    return chars
+
+
+def format_rows(prefix, values, separators, decimals=0):
+    """
+    Format a 2D array as text lines, e.g. format_rows("v ", vertices, "  \\n", 6).
+    separators holds the character written after each column, the last one ends the line.
+    Returns the text and the end offset of every line in it.
+    """
+    values = np.asarray(values)
+    rows, columns = values.shape
+    # Built transposed, so every character position is one contiguous row
+    chars = _digits(values.T.ravel(), decimals)
+    width = len(chars)
+    chars = chars.reshape(width, columns, rows)
+
+    line = np.empty((len(prefix) + columns * (width + 1), rows), dtype=np.uint8)
+    for position, char in enumerate(prefix.encode()):
+        line[position] = char
+    for column, separator in enumerate(separators.encode()):
+        start = len(prefix) + column * (width + 1)
+        line[start:start + width] = chars[:, column]
+        line[start + width] = separator
+    # Dropping the NUL padding is a single pass in C
+    text = line.T.tobytes().translate(None, b"\0")
+    return text, np.flatnonzero(np.frombuffer(text, dtype=np.uint8) == ord("\n")) + 1
+
+
+class ObjWriter:
+    def __init__(self, path, compress=None, precision=DEFAULT_PRECISION, chunk_rows=CHUNK_ROWS):
+        """
+        Write Wavefront OBJ files a whole array at a time instead of line by line.
+        Small meshes are collected and formatted together, so call close() or use
+        the writer as a context manager to write the last batch.
+
+        :param compress: "gzip" to write a gzip compressed file, by default
+            compressed if the path ends in .gz
+        :param precision: Decimals of coordinates and normals. None prints
+            every float exactly like str(float), which is several times slower.
+        """
+        if compress is None and path.endswith(".gz"):
+            compress = "gzip"
+        if compress not in (None, "gzip"):
+            raise ValueError(f"Unsupported compression: {compress}")
+        self.path = path
+        self.precision = precision
+        self.chunk_rows = chunk_rows
+        self.raw = io.open(path, "wb", buffering=BUFFER_SIZE)
+        self.file = (gzip.GzipFile(fileobj=self.raw, mode="wb", compresslevel=GZIP_LEVEL, mtime=0)
+                     if compress else self.raw)
+        # OBJ indices are 1-based and global, each mesh continues after the previous one
+        self.vertex_offset = 1
+        self.normal_offset = 1
+        # Meshes waiting to be formatted: list of (vertices, normals, corners) arrays
+        self.pending = []
+        self.pending_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.flush()
+        if self.file is not self.raw:
+            self.file.close()
+        self.raw.close()
+
+    def write_line(self, line):
+        self.flush()
+        self.file.write(f"{line}\n".encode())
+
+    def write_mesh(self, vertices, faces, normals=None):
+        """
+        Write the vertices, normals and triangles of one mesh. Faces index the
+        mesh's own vertices from 0 and are shifted past all previously written meshes.
+        """
+        vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+        faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+        if normals is not None and len(normals):
+            normals = np.asarray(normals, dtype=np.float64).reshape(-1, 3)
+            # Each corner as vertex/normal, interleaved per triangle
+            corners = np.stack([faces + self.vertex_offset, faces + self.normal_offset], axis=2).reshape(-1, 6)
+            self.normal_offset += len(normals)
+        else:
+            normals = np.empty((0, 3))
+            corners = faces + self.vertex_offset
+        self.vertex_offset += len(vertices)
+        self.pending.append((vertices, normals, corners))
+        self.pending_rows += len(vertices) + len(normals) + len(corners)
+        if self.pending_rows >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Format the pending meshes, one pass per line kind, and write them in mesh order
+        """
+        if not self.pending:
+            return
+        vertices, normals, corners = zip(*self.pending)
+        sections = [
+            self._format_floats("v ", vertices),
+            self._format_floats("vn ", normals),
+            # Meshes with and without normals have differently shaped faces
+            self._format_faces([faces for faces in corners if faces.shape[1] == 6], "/ / /\n"),
+            self._format_faces([faces for faces in corners if faces.shape[1] == 3], "  \n"),
+        ]
+        rows = [
+            [len(mesh) for mesh in vertices],
+            [len(mesh) for mesh in normals],
+            [len(faces) if faces.shape[1] == 6 else 0 for faces in corners],
+            [len(faces) if faces.shape[1] == 3 else 0 for faces in corners],
+        ]
+        parts = []
+        positions = [0] * len(sections)
+        for mesh in range(len(self.pending)):
+            for section, ((text, line_ends), counts) in enumerate(zip(sections, rows)):
+                if not counts[mesh]:
+                    continue
+                first = positions[section]
+                positions[section] += counts[mesh]
+                start = line_ends[first - 1] if first else 0
+                parts.append(text[start:line_ends[positions[section] - 1]])
+        self.file.write(b"".join(parts))
+        self.pending = []
+        self.pending_rows = 0
+
+    def _format_floats(self, prefix, arrays):
+        values = np.concatenate(arrays)
+        if self.precision is None:
+            # tolist() hands out Python floats, so %r prints them like str(float)
+            lines = [f"{prefix}{x!r} {y!r} {z!r}\n".encode() for x, y, z in values.tolist()]
+            return b"".join(lines), np.cumsum([len(line) for line in lines], dtype=np.int64)
+        return format_rows(prefix, values, "  \n", self.precision)
+
+    @staticmethod
+    def _format_faces(arrays, separators):
+        if not arrays:
+            return b"", np.empty(0, dtype=np.int64)
+        return format_rows("f ", np.concatenate(arrays), separators)
@@ -9,11 +9,14 @@ app = FastAPI()
 sensordata = {"name":"DummyData","value": 0, "timestamp": str(datetime.now())}
 
 # Background task to update data
-async def update_data():
+async def update_data(publish=None):
     while True:
         # Generate new dummy data
         sensordata["name"] = "DummyData"
         sensordata["value"] = random.randint(0, 100)  # Example: random integer
         sensordata["timestamp"] = str(datetime.now())  # Add a timestamp
+        # Share the reading with other worker processes
+        if publish is not None:
+            await publish(dict(sensordata))
         await asyncio.sleep(1)  # Update every second
 
@@ -0,0 +1,312 @@
+import abc
+import asyncio
+import functools
+import importlib.util
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Threads available for blocking filesystem or S3 calls, shared by all requests
+STORAGE_THREADS = int(os.environ.get("STORAGE_THREADS", 8))
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class StorageError(Exception):
+    pass
+
+
+class Storage(abc.ABC):
+    """
+    Async interface to where uploads are kept. Keys are "folder/filename" paths.
+    Blocking work runs on a bounded thread pool so the event loop stays free.
+    Backends implement the blocking methods below.
+    """
+
+    def __init__(self, max_workers=STORAGE_THREADS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="storage")
+
+    async def _run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    async def list_folders(self):
+        """
+        Return [{"folder_name", "files", "uploaded_at"}] for every stored folder
+        """
+        return await self._run(self._list_folders)
+
+    async def list_folder(self, folder):
+        """
+        Return the list_folders entry of one folder, None if it does not exist
+        """
+        return await self._run(self._list_folder, folder)
+
+    async def folder_exists(self, folder):
+        return await self._run(self._folder_exists, folder)
+
+    async def exists(self, key):
+        return await self._run(self._exists, key)
+
+    async def save(self, key, stream):
+        """
+        Copy a binary stream into storage and return the number of bytes written
+        """
+        return await self._run(self._save, key, stream)
+
+    async def delete_folder(self, folder):
+        await self._run(self._delete_folder, folder)
+
+    async def archive_folder(self, folder):
+        """
+        Zip a folder and return (local zip path, whether the caller should delete it after use)
+        """
+        return await self._run(self._archive_folder, folder)
+
+    async def materialize(self, key):
+        """
+        Make sure the object is available on local disk, for tools that need a path
+        like the converter. Returns the local directory the key is relative to.
+        """
+        return await self._run(self._materialize, key)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    @abc.abstractmethod
+    def location(self, key):
+        """
+        Where a key is stored, as reported to clients
+        """
+
+    @abc.abstractmethod
+    def _list_folders(self):
+        ...
+
+    @abc.abstractmethod
+    def _list_folder(self, folder):
+        ...
+
+    @abc.abstractmethod
+    def _folder_exists(self, folder):
+        ...
+
+    @abc.abstractmethod
+    def _exists(self, key):
+        ...
+
+    @abc.abstractmethod
+    def _save(self, key, stream):
+        ...
+
+    @abc.abstractmethod
+    def _delete_folder(self, folder):
+        ...
+
+    @abc.abstractmethod
+    def _archive_folder(self, folder):
+        ...
+
+    @abc.abstractmethod
+    def _materialize(self, key):
+        ...
+
+
+class LocalStorage(Storage):
+    def __init__(self, root, max_workers=STORAGE_THREADS):
+        super().__init__(max_workers)
+        # Created by the first upload
+        self.root = root
+
+    def location(self, key):
+        return os.path.join(self.root, key)
+
+    def _list_folders(self):
+        folders = []
+        if not os.path.exists(self.root):
+            return folders
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    folders.append(self._folder_entry(entry.name, entry.path, entry.stat()))
+        return folders
+
+    def _list_folder(self, folder):
+        path = self.location(folder)
+        if not os.path.isdir(path):
+            return None
+        return self._folder_entry(folder, path, os.stat(path))
+
+    @staticmethod
+    def _folder_entry(folder, path, stat):
+        return {
+            "folder_name": folder,
+            "files": os.listdir(path),
+            "uploaded_at": datetime.fromtimestamp(stat.st_ctime).isoformat()
+        }
+
+    def _folder_exists(self, folder):
+        return os.path.isdir(self.location(folder))
+
+    def _exists(self, key):
+        return os.path.exists(self.location(key))
+
+    def _save(self, key, stream):
+        path = self.location(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write next to the target and swap it in so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(stream, f, COPY_BUFFER_SIZE)
+                size = f.tell()
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return size
+
+    def _delete_folder(self, folder):
+        shutil.rmtree(self.location(folder))
+        zip_path = f"{self.location(folder)}.zip"
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+
+    def _archive_folder(self, folder):
+        # Every download gets its own archive, so concurrent downloads of the
+        # same folder never overwrite a zip that is still being sent
+        fd, zip_path = tempfile.mkstemp(dir=self.root, prefix=f".{folder}-", suffix=".zip")
+        os.close(fd)
+        shutil.make_archive(zip_path[:-len(".zip")], 'zip', self.location(folder))
+        return zip_path, True
+
+    def _materialize(self, key):
+        return self.root
+
+
+class S3Storage(Storage):
+    def __init__(self, bucket, prefix="", endpoint_url=None, cache_dir=None, max_workers=STORAGE_THREADS):
+        """
+        Keep uploads in an S3-compatible bucket. endpoint_url points at a local
+        stand-in such as MinIO for development and testing.
+        """
+        super().__init__(max_workers)
+        # boto3 takes long to import, check it is there now but load it on first use
+        if importlib.util.find_spec("boto3") is None:
+            raise StorageError("S3 storage requires boto3, install it with 'pip install boto3'")
+        self.endpoint_url = endpoint_url
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        # Local copies of objects needed on disk (conversion input, archives)
+        # Created on first use, like the upload directory of local storage
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), "bim-viewer-s3-cache")
+
+    @functools.cached_property
+    def client(self):
+        import boto3
+
+        return boto3.client("s3", endpoint_url=self.endpoint_url)
+
+    def location(self, key):
+        return f"s3://{self.bucket}/{self.prefix}{key}"
+
+    def _objects(self, prefix=""):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            for item in page.get("Contents", []):
+                yield item["Key"][len(self.prefix):], item
+
+    def _list_folders(self, prefix=""):
+        folders = {}
+        for key, item in self._objects(prefix):
+            if "/" not in key:
+                continue
+            folder, filename = key.split("/", 1)
+            entry = folders.setdefault(folder, {"folder_name": folder, "files": [], "uploaded_at": None})
+            entry["files"].append(filename)
+            modified = item["LastModified"].replace(tzinfo=None)
+            if entry["uploaded_at"] is None or modified < entry["uploaded_at"]:
+                entry["uploaded_at"] = modified
+        for entry in folders.values():
+            entry["uploaded_at"] = entry["uploaded_at"].isoformat()
+        return list(folders.values())
+
+    def _list_folder(self, folder):
+        folders = self._list_folders(f"{folder}/")
+        return folders[0] if folders else None
+
+    def _folder_exists(self, folder):
+        return next(self._objects(f"{folder}/"), None) is not None
+
+    def _exists(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def _save(self, key, stream):
+        start = stream.tell()
+        size = stream.seek(0, os.SEEK_END) - start
+        stream.seek(start)
+        self.client.upload_fileobj(stream, self.bucket, self.prefix + key)
+        # Drop a stale local copy of an earlier upload
+        cached = os.path.join(self.cache_dir, key)
+        if os.path.exists(cached):
+            os.remove(cached)
+        return size
+
+    def _delete_folder(self, folder):
+        keys = [{"Key": item["Key"]} for _, item in self._objects(f"{folder}/")]
+        # delete_objects accepts at most 1000 keys per call
+        for start in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": keys[start:start + 1000]})
+        cached = os.path.join(self.cache_dir, folder)
+        if os.path.isdir(cached):
+            shutil.rmtree(cached)
+
+    def _archive_folder(self, folder):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, zip_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".zip")
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as archive:
+            for key, item in self._objects(f"{folder}/"):
+                body = self.client.get_object(Bucket=self.bucket, Key=item["Key"])["Body"]
+                with archive.open(key.split("/", 1)[1], "w") as member:
+                    shutil.copyfileobj(body, member, COPY_BUFFER_SIZE)
+        return zip_path, True
+
+    def _materialize(self, key):
+        path = os.path.join(self.cache_dir, key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.part"
+            self.client.download_file(self.bucket, self.prefix + key, temp_path)
+            os.replace(temp_path, path)
+        return self.cache_dir
+
+
+def create_storage(upload_dir):
+    """
+    Build the storage backend selected by STORAGE_BACKEND ("local" or "s3")
+    """
+    backend = os.environ.get("STORAGE_BACKEND", "local")
+    if backend == "local":
+        return LocalStorage(upload_dir)
+    if backend == "s3":
+        return S3Storage(
+            bucket=os.environ["S3_BUCKET"],
+            prefix=os.environ.get("S3_PREFIX", ""),
+            endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+            cache_dir=os.environ.get("S3_CACHE_DIR"),
+        )
+    raise StorageError(f"Unknown storage backend: {backend}")
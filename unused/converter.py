@@ -1,10 +1,14 @@
 from ifcopenshell import geom, open
+from ifcopenshell.util import shape as shape_util
+import io
 import os
 from xml.etree import ElementTree as ET
 from datetime import datetime
 import logging
 import tempfile
 
+from obj_writer import ObjWriter
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -88,45 +92,19 @@ class IFCConverter:
                 obj_path = os.path.join(self.obj_dir, f"{base_filename}.obj")
                 mtl_path = os.path.join(self.obj_dir, f"{base_filename}.mtl")
 
-                # Open OBJ and MTL files for writing
-                with open(obj_path, 'w') as obj_file, open(mtl_path, 'w') as mtl_file:
-                    obj_file.write(f"mtllib {os.path.basename(mtl_path)}\n")
-
-                    vertex_offset = 1
-                    normal_offset = 1
+                # Open OBJ and MTL files for writing, open is IfcOpenShell's here
+                with ObjWriter(obj_path) as obj_file, io.open(mtl_path, 'w') as mtl_file:
+                    obj_file.write_line(f"mtllib {os.path.basename(mtl_path)}")
 
                     # Process each shape
                     if iterator.initialize():
                         while True:
                             shape = iterator.get()
 
-                            # Write vertices
-                            verts = shape.verts
-                            for i in range(0, len(verts), 3):
-                                obj_file.write(f"v {verts[i]} {verts[i + 1]} {verts[i + 2]}\n")
-
-                            # Write normals if available
-                            normals = shape.normals
-                            if normals:
-                                for i in range(0, len(normals), 3):
-                                    obj_file.write(f"vn {normals[i]} {normals[i + 1]} {normals[i + 2]}\n")
-
-                            # Write faces
-                            faces = shape.faces
-                            for i in range(0, len(faces), 3):
-                                if normals:
-                                    v1, v2, v3 = faces[i:i + 3]
-                                    obj_file.write(f"f {v1 + vertex_offset}/{v1 + normal_offset} "
-                                                   f"{v2 + vertex_offset}/{v2 + normal_offset} "
-                                                   f"{v3 + vertex_offset}/{v3 + normal_offset}\n")
-                                else:
-                                    v1, v2, v3 = faces[i:i + 3]
-                                    obj_file.write(
-                                        f"f {v1 + vertex_offset} {v2 + vertex_offset} {v3 + vertex_offset}\n")
-
-                            vertex_offset += len(verts) // 3
-                            if normals:
-                                normal_offset += len(normals) // 3
+                            # Write vertices, normals if available and faces as whole arrays
+                            obj_file.write_mesh(shape_util.get_vertices(shape.geometry),
+                                                shape_util.get_faces(shape.geometry),
+                                                shape_util.get_normals(shape.geometry))
 
                             if not iterator.next():
                                 break